@@ -0,0 +1,457 @@
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED.
+#
+# In-process stand-in for the AWS APIs used by the Lambda functions (EC2, Config aggregator,
+# STS, Inspector and DynamoDB). Real boto3 clients are created as usual, the simulator then
+# answers every call from a 'before-call' event hook so no request ever leaves the process.
+# Parameter validation, waiters, paginators and the DynamoDB resource layer all still run
+# through botocore, so the code under test sees the same responses it would in AWS.
+import copy
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+import boto3
+from botocore import xform_name
+
+# keep a handle on the real sleep, time.sleep is patched while the simulator is active
+_real_sleep = time.sleep
+
+CONFIG_PAGE_SIZE = 100
+TEST_NAMES = ['SSM-Test', 'SSMRedhat', 'SSMWin2019']
+# tables not listed are keyed on InstanceId alone
+KEY_SCHEMA = {'Inspector-Instance-Uptime': ('SeriesId', 'EventKey')}
+
+
+class SimulatedError(Exception):
+    def __init__(self, code, message, status=400):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.status = status
+
+
+class FakeHttpResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.content = body
+        self.headers = {'content-length': str(len(body))}
+
+
+class AwsSimulator:
+    def __init__(self, accounts=1, regions=1, instances=10, running_ratio=0.0, exception_ratio=0.0,
+                 latency_ms=0.0, latency_jitter_ms=0.0, throttle_rate=0.0, throttle_backoff_ms=50.0,
+                 config_lag=0.0, boot_seconds=30.0, shutdown_seconds=30.0, status_seconds=60.0,
+                 assessment_seconds=900.0, untagged_ratio=0.0, names=None, start_groups=None, time_scale=0.0,
+                 seed=1):
+        self.rand = random.Random(seed)
+        self.accounts = ['%012d' % (111111111111 * (i + 1)) for i in range(accounts)]
+        self.regions = ['us-east-1', 'us-east-2', 'us-west-1', 'us-west-2', 'eu-west-1',
+                        'eu-central-1', 'ap-southeast-1', 'ap-northeast-1'][:regions]
+        self.caller_account = self.accounts[0]
+        self.latency = latency_ms / 1000.0
+        self.latency_jitter = latency_jitter_ms / 1000.0
+        self.throttle_rate = throttle_rate
+        self.throttle_backoff = throttle_backoff_ms / 1000.0
+        self.config_lag = config_lag
+        self.boot_seconds = boot_seconds
+        self.shutdown_seconds = shutdown_seconds
+        self.status_seconds = status_seconds
+        self.assessment_seconds = assessment_seconds
+        # 0 skips sleeps and adds them to the clock, otherwise every simulated second takes
+        # time_scale real seconds so concurrent waits overlap like they would in AWS
+        self.time_scale = time_scale
+
+        self.lock = threading.RLock()
+        self.api_calls = Counter()
+        self.throttles = Counter()
+        self.skipped_sleep = 0.0
+        self._t0 = time.monotonic()
+        self._epoch = time.time()
+        self._keys = {}
+
+        # instances[(account, region)][instance_id] = {'name', 'tags', 'history': [(t, state)]}
+        self.instances = {}
+        # tables[(region, table_name)] = {key: item} with items in DynamoDB wire format
+        self.tables = {}
+        self.assessment_runs = {}
+
+        names = names or TEST_NAMES
+        serial = 0
+        for account in self.accounts:
+            for region in self.regions:
+                fleet = {}
+                for i in range(instances):
+                    serial += 1
+                    instance_id = 'i-%017x' % serial
+                    state = 'running' if self.rand.random() < running_ratio else 'stopped'
+                    name = names[i % len(names)]
+                    tags = [{'Key': 'Name', 'Value': name}]
+                    if start_groups:
+                        tags.extend(start_groups[i % len(start_groups)])
+                    # EC2 leaves out 'Tags' and Config 'tags' for instances without any
+                    if self.rand.random() < untagged_ratio:
+                        name, tags = '', []
+                    fleet[instance_id] = {'name': name, 'tags': tags, 'history': [(-1e9, state)]}
+                    if self.rand.random() < exception_ratio:
+                        self.put_exception(instance_id, account, region,
+                                           self.rand.choice(['DoNotStart', 'DoNotStop']))
+                self.instances[(account, region)] = fleet
+
+    # -- simulated clock ---------------------------------------------------------------------
+
+    def now(self):
+        if self.time_scale:
+            return (time.monotonic() - self._t0) / self.time_scale
+        return time.monotonic() - self._t0 + self.skipped_sleep
+
+    def time(self):
+        return self._epoch + self.now()
+
+    def utcnow(self):
+        return datetime.fromtimestamp(self.time(), tz=timezone.utc)
+
+    def sleep(self, seconds):
+        if self.time_scale:
+            _real_sleep(max(seconds, 0) * self.time_scale)
+            return
+        with self.lock:
+            self.skipped_sleep += max(seconds, 0)
+
+    def state_of(self, instance, at=None):
+        at = self.now() if at is None else at
+        state = instance['history'][0][1]
+        for t, s in instance['history']:
+            if t > at:
+                break
+            state = s
+        return state
+
+    def set_state(self, instance, state, at=None):
+        at = self.now() if at is None else at
+        history = instance['history']
+        # collapse history older than the Config lag so long runs do not grow it unbounded
+        horizon = self.now() - self.config_lag
+        while len(history) > 1 and history[1][0] <= horizon:
+            history.pop(0)
+        history.append((at, state))
+
+    # -- seeding helpers -----------------------------------------------------------------------
+
+    def table(self, region, name):
+        return self.tables.setdefault((region, name), {})
+
+    def put_exception(self, instance_id, account, region, exception_type):
+        self.table(region, 'Inspector-Exceptions')[instance_id] = {
+            'InstanceId': {'S': instance_id}, 'AccountId': {'S': account},
+            'InstanceRegion': {'S': region}, 'ExceptionType': {'S': exception_type}}
+
+    def fleet_states(self):
+        states = Counter()
+        for fleet in self.instances.values():
+            for instance in fleet.values():
+                states[self.state_of(instance)] += 1
+        return states
+
+    # -- boto3 wiring --------------------------------------------------------------------------
+
+    @contextmanager
+    def activate(self):
+        original_client = boto3.session.Session.client
+        simulator = self
+
+        def client(session, service_name, *args, **kwargs):
+            cli = original_client(session, service_name, *args, **kwargs)
+            simulator.attach(cli, simulator._keys.get(kwargs.get('aws_access_key_id')))
+            return cli
+
+        # time.time follows the simulated clock so recorded timestamps include skipped sleeps
+        with mock.patch.object(boto3.session.Session, 'client', client), \
+                mock.patch('time.sleep', self.sleep), mock.patch('time.time', self.time):
+            yield self
+
+    def attach(self, cli, account=None):
+        def capture_params(params, context, **kwargs):
+            context['simulator_params'] = params
+
+        def answer(model, context, **kwargs):
+            return self.dispatch(cli.meta.service_model.service_name, model.name,
+                                 context.get('simulator_params', {}), account or self.caller_account,
+                                 cli.meta.region_name)
+
+        # registered on the bare event name so it runs after service specific transforms
+        cli.meta.events.register('before-parameter-build', capture_params)
+        cli.meta.events.register('before-call', answer)
+
+    def dispatch(self, service, operation, params, account, region):
+        key = '%s.%s' % (service, operation)
+        delay = self.latency + (self.rand.uniform(0, self.latency_jitter) if self.latency_jitter else 0)
+        retries = 0
+        # a throttled request is retried by botocore, so it only costs the backoff
+        while self.throttle_rate and self.rand.random() < self.throttle_rate and retries < 4:
+            retries += 1
+            delay += self.throttle_backoff * (2 ** (retries - 1))
+        if delay:
+            _real_sleep(delay * self.time_scale if self.time_scale else delay)
+
+        with self.lock:
+            self.api_calls[key] += 1
+            if retries:
+                self.throttles[key] += retries
+            handler = getattr(self, '_%s_%s' % (service, xform_name(operation)), None)
+            try:
+                if handler is None:
+                    raise SimulatedError('UnsupportedOperation', '%s is not simulated' % key)
+                # callers transform responses in place, never hand out the stored objects
+                parsed = copy.deepcopy(handler(params, account, region))
+                status = 200
+            except SimulatedError as e:
+                parsed = {'Error': {'Code': e.code, 'Message': e.message}}
+                status = e.status
+
+        parsed['ResponseMetadata'] = {'RequestId': 'sim-%d' % self.api_calls[key],
+                                      'HTTPStatusCode': status, 'HTTPHeaders': {},
+                                      'RetryAttempts': retries}
+        body = json.dumps(parsed, default=str).encode('utf-8')
+        return FakeHttpResponse(status, body), parsed
+
+    # -- EC2 -----------------------------------------------------------------------------------
+
+    def _fleet(self, account, region):
+        return self.instances.get((account, region), {})
+
+    def _lookup(self, fleet, instance_ids):
+        missing = [i for i in instance_ids if i not in fleet]
+        if missing:
+            raise SimulatedError('InvalidInstanceID.NotFound',
+                                 "The instance IDs '%s' do not exist" % ', '.join(missing))
+        return [fleet[i] for i in instance_ids]
+
+    def _ec2_describe_instances(self, params, account, region):
+        fleet = self._fleet(account, region)
+        ids = params.get('InstanceIds') or list(fleet)
+        self._lookup(fleet, ids)
+        filters = {f['Name']: set(f['Values']) for f in params.get('Filters', [])}
+        if 'owner-id' in filters and account not in filters['owner-id']:
+            ids = []
+
+        matched = []
+        for instance_id in ids:
+            instance = fleet[instance_id]
+            state = self.state_of(instance)
+            if 'instance-state-name' in filters and state not in filters['instance-state-name']:
+                continue
+            if 'instance-id' in filters and instance_id not in filters['instance-id']:
+                continue
+            tags = {t['Key']: t['Value'] for t in instance['tags']}
+            if any(name.startswith('tag:') and tags.get(name[4:]) not in values
+                   for name, values in filters.items()):
+                continue
+            matched.append((instance_id, instance, state))
+
+        start = int(params.get('NextToken') or 0)
+        page_size = params.get('MaxResults') or len(matched) or 1
+        page = matched[start:start + page_size]
+
+        reservations = []
+        for instance_id, instance, state in page:
+            description = {'InstanceId': instance_id, 'State': {'Name': state}}
+            if instance['tags']:
+                description['Tags'] = list(instance['tags'])
+            reservations.append({'OwnerId': account, 'Instances': [description]})
+        response = {'Reservations': reservations}
+        if start + page_size < len(matched):
+            response['NextToken'] = str(start + page_size)
+        return response
+
+    def _transition(self, params, account, region, from_state, interim, final, seconds):
+        changes = []
+        now = self.now()
+        for instance_id, instance in zip(params['InstanceIds'],
+                                         self._lookup(self._fleet(account, region), params['InstanceIds'])):
+            previous = self.state_of(instance)
+            if previous == from_state:
+                self.set_state(instance, interim, now)
+                self.set_state(instance, final, now + seconds)
+            changes.append({'InstanceId': instance_id, 'PreviousState': {'Name': previous},
+                            'CurrentState': {'Name': self.state_of(instance)}})
+        return changes
+
+    def _ec2_describe_instance_status(self, params, account, region):
+        fleet = self._fleet(account, region)
+        ids = params.get('InstanceIds') or list(fleet)
+        now = self.now()
+        statuses = []
+        for instance_id, instance in zip(ids, self._lookup(fleet, ids)):
+            if self.state_of(instance, now) != 'running':
+                continue
+            running_since = None
+            for t, state in instance['history']:
+                if t > now:
+                    break
+                running_since = (running_since if running_since is not None else t) if state == 'running' else None
+            status = 'ok' if now - running_since >= self.status_seconds else 'initializing'
+            statuses.append({'InstanceId': instance_id, 'InstanceState': {'Name': 'running'},
+                             'InstanceStatus': {'Status': status}, 'SystemStatus': {'Status': status}})
+        return {'InstanceStatuses': statuses}
+
+    def _ec2_start_instances(self, params, account, region):
+        return {'StartingInstances': self._transition(params, account, region, 'stopped', 'pending',
+                                                      'running', self.boot_seconds)}
+
+    def _ec2_stop_instances(self, params, account, region):
+        return {'StoppingInstances': self._transition(params, account, region, 'running', 'stopping',
+                                                      'stopped', self.shutdown_seconds)}
+
+    # -- Config aggregator ---------------------------------------------------------------------
+
+    def _config_select_aggregate_resource_config(self, params, account, region):
+        expression = params['Expression']
+        wanted_account = re.search(r"accountId\s*=\s*'([^']*)'", expression)
+        wanted_region = re.search(r"awsRegion\s*=\s*'([^']*)'", expression)
+
+        results = []
+        as_of = self.now() - self.config_lag
+        for (acct, rgn), fleet in self.instances.items():
+            if wanted_account and acct != wanted_account.group(1):
+                continue
+            if wanted_region and rgn != wanted_region.group(1):
+                continue
+            for instance_id, instance in fleet.items():
+                result = {'accountId': acct, 'awsRegion': rgn, 'resourceId': instance_id,
+                          'configuration': {'state': {'name': self.state_of(instance, as_of)}}}
+                if instance['tags']:
+                    result['tags'] = [{'key': t['Key'], 'value': t['Value']} for t in instance['tags']]
+                results.append(json.dumps(result))
+
+        start = int(params.get('NextToken') or 0)
+        page_size = min(params.get('Limit') or CONFIG_PAGE_SIZE, CONFIG_PAGE_SIZE)
+        response = {'Results': results[start:start + page_size],
+                    'QueryInfo': {'SelectFields': [{'Name': 'resourceId'}]}}
+        if start + page_size < len(results):
+            response['NextToken'] = str(start + page_size)
+        return response
+
+    # -- STS -----------------------------------------------------------------------------------
+
+    def _sts_assume_role(self, params, account, region):
+        target = re.search(r'arn:aws[\w-]*:iam::(\d+):role/', params['RoleArn'])
+        if not target or target.group(1) not in self.accounts:
+            raise SimulatedError('AccessDenied', 'Not authorized to assume %s' % params['RoleArn'], 403)
+        access_key = 'ASIASIM%05d%s' % (len(self._keys), target.group(1))
+        self._keys[access_key] = target.group(1)
+        return {'Credentials': {'AccessKeyId': access_key, 'SecretAccessKey': 'simulated',
+                                'SessionToken': 'simulated',
+                                'Expiration': self.utcnow() + timedelta(hours=1)},
+                'AssumedRoleUser': {'AssumedRoleId': 'AROASIM:' + params['RoleSessionName'],
+                                    'Arn': params['RoleArn']}}
+
+    # -- Inspector -----------------------------------------------------------------------------
+
+    def _inspector_describe_assessment_templates(self, params, account, region):
+        templates = [{'arn': arn, 'name': 'simulated', 'assessmentTargetArn': arn.split('/template/')[0],
+                      'durationInSeconds': int(self.assessment_seconds), 'rulesPackageArns': [], 'userAttributesForFindings': [],
+                      'assessmentRunCount': 0, 'createdAt': self.utcnow()}
+                     for arn in params['assessmentTemplateArns']]
+        return {'assessmentTemplates': templates, 'failedItems': {}}
+
+    def _inspector_start_assessment_run(self, params, account, region):
+        arn = '%s/run/0-%08d' % (params['assessmentTemplateArn'], len(self.assessment_runs) + 1)
+        self.assessment_runs[arn] = {'startedAt': self.now(), 'name': params.get('assessmentRunName')}
+        return {'assessmentRunArn': arn}
+
+    def _inspector_describe_assessment_runs(self, params, account, region):
+        runs = []
+        failed = {}
+        for arn in params['assessmentRunArns']:
+            run = self.assessment_runs.get(arn)
+            if run is None:
+                failed[arn] = {'failureCode': 'ITEM_DOES_NOT_EXIST', 'retryable': False}
+                continue
+            started = datetime.fromtimestamp(self._epoch + run['startedAt'], tz=timezone.utc)
+            completed = self.now() >= run['startedAt'] + self.assessment_seconds
+            description = {'arn': arn, 'name': run['name'], 'state': 'COMPLETED' if completed else 'COLLECTING_DATA',
+                           'startedAt': started}
+            if completed:
+                description['completedAt'] = started + timedelta(seconds=self.assessment_seconds)
+            runs.append(description)
+        return {'assessmentRuns': runs, 'failedItems': failed}
+
+    # -- DynamoDB ------------------------------------------------------------------------------
+
+    def _key_of(self, table_name, item):
+        return tuple(item[name]['S'] for name in KEY_SCHEMA.get(table_name, ('InstanceId',)))
+
+    def _dynamodb_scan(self, params, account, region):
+        items = list(self.table(region, params['TableName']).values())
+        return {'Items': items, 'Count': len(items), 'ScannedCount': len(items)}
+
+    def _dynamodb_put_item(self, params, account, region):
+        self.table(region, params['TableName'])[self._key_of(params['TableName'], params['Item'])] = params['Item']
+        return {}
+
+    def _dynamodb_delete_item(self, params, account, region):
+        self.table(region, params['TableName']).pop(self._key_of(params['TableName'], params['Key']), None)
+        return {}
+
+    def _dynamodb_batch_write_item(self, params, account, region):
+        for table_name, requests in params['RequestItems'].items():
+            table = self.table(region, table_name)
+            for request in requests:
+                if 'PutRequest' in request:
+                    table[self._key_of(table_name, request['PutRequest']['Item'])] = request['PutRequest']['Item']
+                else:
+                    table.pop(self._key_of(table_name, request['DeleteRequest']['Key']), None)
+        return {'UnprocessedItems': {}}
+
+    def _dynamodb_query(self, params, account, region):
+        table = self.table(region, params['TableName'])
+        names = params.get('ExpressionAttributeNames', {})
+        values = params.get('ExpressionAttributeValues', {})
+        matched = [item for item in table.values()
+                   if _matches(params['KeyConditionExpression'], item, names, values)
+                   and _matches(params.get('FilterExpression'), item, names, values)]
+        # queries on the table itself come back in range key order
+        if 'IndexName' not in params and params['TableName'] in KEY_SCHEMA:
+            matched.sort(key=lambda item: self._key_of(params['TableName'], item))
+        return {'Items': matched, 'Count': len(matched), 'ScannedCount': len(matched)}
+
+
+_COMPARATORS = {
+    '=': lambda a, b: a == b, '<>': lambda a, b: a != b,
+    '<': lambda a, b: a < b, '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b, '>=': lambda a, b: a >= b,
+}
+
+
+def _scalar(value):
+    if value is None:
+        return None
+    (kind, raw), = value.items()
+    return float(raw) if kind == 'N' else raw
+
+
+# evaluates the flat 'a = b AND c < d AND e BETWEEN f AND g' expressions produced by boto3's
+# condition builder
+def _matches(expression, item, names, values):
+    if not expression:
+        return True
+    for name, low, high in re.findall(r'(#\w+)\s+BETWEEN\s+(:\w+)\s+AND\s+(:\w+)', expression):
+        actual = _scalar(item.get(names[name]))
+        if actual is None or not _scalar(values[low]) <= actual <= _scalar(values[high]):
+            return False
+    expression = re.sub(r'(#\w+)\s+BETWEEN\s+(:\w+)\s+AND\s+(:\w+)', '', expression)
+    for clause in filter(None, (c.strip('() ') for c in re.split(r'\bAND\b', expression))):
+        found = re.match(r'(#\w+)\s*(<>|<=|>=|=|<|>)\s*(:\w+)$', clause)
+        if not found:
+            raise SimulatedError('ValidationException', 'Unsupported expression: ' + clause)
+        name, op, placeholder = found.groups()
+        actual = _scalar(item.get(names[name]))
+        if actual is None or not _COMPARATORS[op](actual, _scalar(values[placeholder])):
+            return False
+    return True
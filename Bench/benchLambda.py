@@ -0,0 +1,264 @@
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED.
+#
+# Drives lambda_handler in the Lambda folder against the in-process AWS simulator and reports
+# wall time, API calls per operation, log volume and peak memory for every phase.
+#
+#   python Bench/benchLambda.py --accounts 3 --regions 2 --instances 200 --latency-ms 20
+import argparse
+import importlib.util
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import redirect_stdout
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Lambda')
+# kind -> (handler module, provider override)
+MODULES = {
+    'config': ('lambdaConfigAccess', None),
+    'cross': ('lambdaCrossAccountAccess', None),
+    'hybrid': ('lambdaCrossAccountAccess', 'hybrid'),
+}
+# 'plan' can be added in front, 'reap' anywhere. 'sweep' does start, inspect and stop in one go.
+PHASES = ['start', 'inspect', 'stop', 'report']
+
+
+# counts what the handler prints without keeping it around
+class LogSink(io.TextIOBase):
+    def __init__(self):
+        self.bytes = 0
+        self.lines = 0
+
+    def write(self, text):
+        self.bytes += len(text)
+        self.lines += text.count('\n')
+        return len(text)
+
+
+def load_module(name):
+    if LAMBDA_DIR not in sys.path:
+        sys.path.insert(0, LAMBDA_DIR)
+    spec = importlib.util.spec_from_file_location(name, os.path.join(LAMBDA_DIR, name + '.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def build_event(kind, account, region, action, metrics_format='emf', select_tags=None):
+    event = {
+        'account_id': account,
+        'region_name': region,
+        'insp_assmt_template_arn': 'arn:aws:inspector:%s:%s:target/0-sim/template/0-sim' % (region, account),
+        'action': action,
+        'metrics_format': metrics_format,
+    }
+    if kind != 'config':
+        event['role_arn'] = 'arn:aws:iam::%s:role/Inspector-EC2-Controls' % account
+    if MODULES[kind][1]:
+        event['provider'] = MODULES[kind][1]
+    if select_tags:
+        event['select_tags'] = select_tags
+    return event
+
+
+# one invocation per account/region, or a single invocation listing them all as targets
+def invocations(sim, kind, action, args):
+    if args.batch_targets:
+        event = build_event(kind, sim.accounts[0], sim.regions[0], action, args.metrics_format, args.select_tags)
+        event['targets'] = [{k: v for k, v in build_event(kind, account, region, action).items()
+                             if k in ('account_id', 'region_name', 'role_arn', 'insp_assmt_template_arn')}
+                            for account in sim.accounts for region in sim.regions]
+        return [(sim.accounts[0], 'all', event)]
+    return [(account, region, build_event(kind, account, region, action, args.metrics_format, args.select_tags))
+            for account in sim.accounts for region in sim.regions]
+
+
+def run_phase(sim, module, kind, action, args, plans):
+    calls_before = Counter(sim.api_calls)
+    throttles_before = sum(sim.throttles.values())
+    clock_before = sim.now()
+    sink = LogSink()
+    errors = []
+    planned = None
+    # per target results of report, reap and sweep
+    targets = []
+
+    if not args.no_memory:
+        tracemalloc.reset_peak()
+        mem_before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+
+    for account, region, event in invocations(sim, kind, action, args):
+        sim.caller_account = account
+        if args.replay_plan and action in ('start', 'stop') and (account, region) in plans:
+            event['plan'] = plans[(account, region)]
+        if action == 'reap':
+            event['reap_after_hours'] = args.reap_after_hours
+        if action == 'sweep' and args.pipeline_workers is not None:
+            event['pipeline_workers'] = args.pipeline_workers
+        try:
+            with redirect_stdout(sink):
+                result = module.lambda_handler(event, None)
+            if action == 'plan':
+                plans[(account, region)] = result
+                planned = planned or {'counts': Counter(), 'api_calls': Counter(), 'seconds': Counter()}
+                planned['counts'].update(result['counts'])
+                for step, estimate in result['estimate'].items():
+                    planned['api_calls'][step] += estimate['api_calls']
+                    planned['seconds'][step] += estimate['seconds']
+            elif action in ('report', 'reap', 'sweep'):
+                targets.extend(result['targets'])
+        except Exception as e:
+            errors.append('%s/%s: %s: %s' % (account, region, type(e).__name__, e))
+
+    wall = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1] - mem_before if not args.no_memory else None
+
+    calls = sim.api_calls - calls_before
+    return {
+        'phase': action,
+        'wall_seconds': round(wall, 4),
+        'simulated_seconds': round(sim.now() - clock_before, 1),
+        'api_calls': dict(sorted(calls.items())),
+        'api_calls_total': sum(calls.values()),
+        'throttled_retries': sum(sim.throttles.values()) - throttles_before,
+        'peak_memory_bytes': peak,
+        'log_bytes': sink.bytes,
+        'log_lines': sink.lines,
+        'errors': errors,
+        'plan': planned and {k: dict(v) for k, v in planned.items()},
+        'targets': targets,
+    }
+
+
+# 'db:1,app:2:db,web::app' -> ordering tags per group, given round-robin to the instances
+def parse_start_groups(spec):
+    start_groups = []
+    for entry in filter(None, (spec or '').split(',')):
+        name, priority, depends_on = (entry.split(':') + ['', ''])[:3]
+        tags = [{'Key': 'InspectorStartGroup', 'Value': name}]
+        if priority:
+            tags.append({'Key': 'InspectorStartPriority', 'Value': priority})
+        if depends_on:
+            tags.append({'Key': 'InspectorDependsOn', 'Value': depends_on.replace('+', ',')})
+        start_groups.append(tags)
+    return start_groups
+
+
+# 'Name=SSMRedhat+SSMWin2019,InspectorStartGroup=db' -> {'Name': ['SSMRedhat', 'SSMWin2019'], ...}
+def parse_select_tags(spec):
+    select_tags = {}
+    for entry in filter(None, (spec or '').split(',')):
+        key, _, values = entry.partition('=')
+        select_tags[key] = values.split('+')
+    return select_tags or None
+
+
+def run_module(kind, args):
+    # imported here so benchStartup can time the handler import before boto3 is loaded
+    from awsSimulator import AwsSimulator
+
+    sim = AwsSimulator(accounts=args.accounts, regions=args.regions, instances=args.instances,
+                       running_ratio=args.running_ratio, exception_ratio=args.exception_ratio,
+                       latency_ms=args.latency_ms, latency_jitter_ms=args.latency_jitter_ms,
+                       throttle_rate=args.throttle_rate, throttle_backoff_ms=args.throttle_backoff_ms,
+                       config_lag=args.config_lag, boot_seconds=args.boot_seconds,
+                       shutdown_seconds=args.boot_seconds, status_seconds=args.status_seconds,
+                       assessment_seconds=args.assessment_seconds, untagged_ratio=args.untagged_ratio,
+                       start_groups=parse_start_groups(args.start_groups), time_scale=args.time_scale,
+                       seed=args.seed)
+    module = load_module(MODULES[kind][0])
+    # clients are cached at module scope, drop the ones hooked to a previous simulator
+    import inspectorClients
+    inspectorClients.reset()
+
+    results = []
+    plans = {}
+    with sim.activate():
+        for action in args.phases:
+            results.append(run_phase(sim, module, kind, action, args, plans))
+    return {'module': kind, 'phases': results, 'final_states': dict(sim.fleet_states())}
+
+
+def print_report(report):
+    for module in report['modules']:
+        print('\n== %s ==  final instance states: %s' % (module['module'], module['final_states']))
+        print('%-8s %10s %10s %8s %9s %12s %10s %7s' % ('phase', 'wall(s)', 'sim(s)', 'calls',
+                                                      'throttled', 'peak_mem(KB)', 'log(KB)', 'errors'))
+        for phase in module['phases']:
+            peak = phase['peak_memory_bytes']
+            print('%-8s %10.3f %10.1f %8d %9d %12s %10.1f %7d' % (
+                phase['phase'], phase['wall_seconds'], phase['simulated_seconds'],
+                phase['api_calls_total'], phase['throttled_retries'],
+                '-' if peak is None else '%.1f' % (peak / 1024.0), phase['log_bytes'] / 1024.0,
+                len(phase['errors'])))
+            for operation, count in phase['api_calls'].items():
+                print('           %-45s %6d' % (operation, count))
+            if phase['plan']:
+                print('           plan counts: %s' % phase['plan']['counts'])
+                print('           plan estimate: api_calls=%s seconds=%s' % (phase['plan']['api_calls'],
+                                                                           phase['plan']['seconds']))
+            for target in phase['targets']:
+                print('           %s/%s: %s' % (target['account_id'], target['region_name'], ', '.join(
+                    '%s=%s' % (k, v) for k, v in sorted(target.items()) if k not in ('account_id', 'region_name'))))
+            for error in phase['errors'][:3]:
+                print('           ! %s' % error)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark lambda_handler against a simulated AWS backend')
+    parser.add_argument('--modules', default='config,cross', help='comma separated: config, cross, hybrid')
+    parser.add_argument('--phases', default=','.join(PHASES), help='comma separated actions to run in order')
+    parser.add_argument('--accounts', type=int, default=2)
+    parser.add_argument('--regions', type=int, default=1)
+    parser.add_argument('--instances', type=int, default=50, help='instances per account and region')
+    parser.add_argument('--running-ratio', type=float, default=0.0, help='share of instances already running')
+    parser.add_argument('--exception-ratio', type=float, default=0.1, help='share of instances with an exception')
+    parser.add_argument('--untagged-ratio', type=float, default=0.0, help='share of instances without any tags')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='injected latency per API call')
+    parser.add_argument('--latency-jitter-ms', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='probability a request is throttled')
+    parser.add_argument('--throttle-backoff-ms', type=float, default=50.0)
+    parser.add_argument('--config-lag', type=float, default=180.0, help='seconds before Config sees a state change')
+    parser.add_argument('--boot-seconds', type=float, default=30.0)
+    parser.add_argument('--status-seconds', type=float, default=60.0, help='running to passing status checks')
+    parser.add_argument('--assessment-seconds', type=float, default=900.0, help='duration of an Inspector run')
+    parser.add_argument('--start-groups', help="start ordering tags, e.g. 'db:1,app:2,web::app+db' (name:priority:depends)")
+    parser.add_argument('--time-scale', type=float, default=0.0,
+                        help='real seconds per simulated second, 0 skips sleeps. Use e.g. 0.01 when waits overlap')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--no-memory', action='store_true', help='skip tracemalloc, it slows the run down')
+    parser.add_argument('--metrics-format', default='emf', help='passed to the handler: emf, json or none')
+    parser.add_argument('--batch-targets', action='store_true',
+                        help='one invocation with every account/region in targets instead of one each')
+    parser.add_argument('--select-tags', type=parse_select_tags,
+                        help="passed as select_tags, e.g. 'Name=SSMRedhat+SSMWin2019,InspectorStartGroup=db'")
+    parser.add_argument('--reap-after-hours', type=float, default=0.0,
+                        help="passed to the 'reap' phase, 0 reaps everything still tracked")
+    parser.add_argument('--pipeline-workers', type=int,
+                        help="passed to the 'sweep' phase, caps workers per stage. 0 handles one target at a time")
+    parser.add_argument('--replay-plan', action='store_true', help='pass the result of a plan phase to start/stop')
+    parser.add_argument('--json', help='also write the report to this file')
+    args = parser.parse_args(argv)
+    args.phases = [p for p in args.phases.split(',') if p]
+
+    # clients created without an explicit region (Config) need a default one
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    # the simulator has every table, so record uptime for the report phase
+    os.environ.setdefault('INSPECTOR_UPTIME_STORE', 'dynamodb')
+    if not args.no_memory:
+        tracemalloc.start()
+
+    report = {'parameters': vars(args),
+              'modules': [run_module(kind, args) for kind in args.modules.split(',') if kind]}
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
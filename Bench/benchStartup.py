@@ -0,0 +1,90 @@
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED.
+#
+# Cold and warm start cost of lambda_handler per action. Every sample runs in a fresh Python
+# process: the handler module is imported (Lambda init), invoked once (cold) and invoked again
+# (warm) against the in-process AWS simulator.
+#
+#   python Bench/benchStartup.py --actions plan,start,stop,inspect --repeat 5
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def child(kind, action, instances):
+    import benchLambda  # stdlib only, the simulator is imported below
+    handler_module = benchLambda.MODULES[kind][0]
+    sys.path.insert(0, benchLambda.LAMBDA_DIR)
+
+    started = time.perf_counter()
+    module = __import__(handler_module)
+    import_ms = (time.perf_counter() - started) * 1000.0
+    boto3_at_import = 'boto3' in sys.modules
+
+    # the simulator needs boto3 loaded to hook it, time that separately
+    started = time.perf_counter()
+    import boto3  # noqa: F401
+    boto3_ms = (time.perf_counter() - started) * 1000.0
+
+    from awsSimulator import AwsSimulator
+    import inspectorClients
+    sim = AwsSimulator(accounts=1, regions=1, instances=instances)
+    event = benchLambda.build_event(kind, sim.accounts[0], sim.regions[0], action, 'none')
+    timings = []
+    with sim.activate(), open(os.devnull, 'w') as devnull:
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            for _ in range(2):
+                started = time.perf_counter()
+                module.lambda_handler(dict(event), None)
+                timings.append((time.perf_counter() - started) * 1000.0)
+        finally:
+            sys.stdout = stdout
+
+    print(json.dumps({
+        'import_ms': import_ms, 'boto3_loaded_by_import': boto3_at_import, 'boto3_import_ms': boto3_ms,
+        'cold_ms': timings[0], 'warm_ms': timings[1],
+        'clients': sorted(set(k[0] for k in inspectorClients._clients) |
+                          set('dynamodb:' + k[0] for k in inspectorClients._tables)),
+    }))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Cold/warm init time of lambda_handler per action')
+    parser.add_argument('--modules', default='config,cross', help='comma separated: config, cross, hybrid')
+    parser.add_argument('--actions', default='plan,start,stop,inspect')
+    parser.add_argument('--instances', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=3, help='fresh processes per action, the median is shown')
+    parser.add_argument('--child', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        return child(args.child[0], args.child[1], args.instances)
+
+    env = dict(os.environ)
+    env.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    print('%-7s %-8s %10s %7s %10s %9s %9s  %s' % ('module', 'action', 'import(ms)', 'boto3?', 'boto3(ms)',
+                                                 'cold(ms)', 'warm(ms)', 'clients'))
+    for kind in filter(None, args.modules.split(',')):
+        for action in filter(None, args.actions.split(',')):
+            samples = []
+            for _ in range(args.repeat):
+                output = subprocess.check_output(
+                    [sys.executable, os.path.join(BENCH_DIR, 'benchStartup.py'), '--child', kind, action,
+                     '--instances', str(args.instances)], cwd=BENCH_DIR, env=env)
+                samples.append(json.loads(output.decode('utf-8').strip().splitlines()[-1]))
+
+            def median(key):
+                return statistics.median(s[key] for s in samples)
+            print('%-7s %-8s %10.1f %7s %10.1f %9.1f %9.1f  %s' % (
+                kind, action, median('import_ms'), 'yes' if samples[0]['boto3_loaded_by_import'] else 'no',
+                median('boto3_import_ms'), median('cold_ms'), median('warm_ms'), ','.join(samples[0]['clients'])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED.
+#
+# Checks of the start ordering (InspectorStartGroup/Priority/DependsOn tags). StartDependencies is
+# checked directly, then a start runs against the simulator and the start time of every instance
+# is compared with the time its prerequisite groups passed status checks.
+#
+#   python Bench/checkStartOrder.py
+import io
+import os
+import sys
+from contextlib import redirect_stdout
+
+import benchLambda
+
+
+def group(name, depends_on=(), priority=None):
+    return {'group': name, 'priority': priority, 'depends_on': list(depends_on), 'instances': []}
+
+
+# (groups, expected dependencies)
+CASES = [
+    # plain chain and priorities
+    ([group('db', priority=1), group('app', priority=2), group('web', ['app'])],
+     {'db': set(), 'app': {'db'}, 'web': {'app'}}),
+    # a cycle only loses the edges inside it, groups waiting on the cycle keep waiting
+    ([group('a', ['b']), group('b', ['a']), group('c', ['a'])],
+     {'a': set(), 'b': set(), 'c': {'a'}}),
+    # two independent cycles and a group waiting on both
+    ([group('a', ['b']), group('b', ['a']), group('c', ['d']), group('d', ['c']), group('e', ['a', 'c'])],
+     {'a': set(), 'b': set(), 'c': set(), 'd': set(), 'e': {'a', 'c'}}),
+    # a cycle waiting on another cycle keeps that edge
+    ([group('a', ['b']), group('b', ['c']), group('c', ['a']), group('x', ['y']), group('y', ['x', 'a'])],
+     {'a': set(), 'b': set(), 'c': set(), 'x': set(), 'y': {'a'}}),
+]
+
+
+def check_dependencies(engine):
+    for groups, expected in CASES:
+        dependencies, order = engine.StartDependencies(groups)
+        assert dependencies == expected, (groups, dependencies)
+        for name, waits_on in dependencies.items():
+            assert all(order.index(w) < order.index(name) for w in waits_on), order
+    print('StartDependencies: %d cases ok' % len(CASES))
+
+
+# 'spec' as for benchLambda --start-groups, dependencies expected after cycles are broken
+def check_simulated_start(spec, expected):
+    from awsSimulator import AwsSimulator
+    import inspectorClients
+
+    sim = AwsSimulator(instances=12, start_groups=benchLambda.parse_start_groups(spec), time_scale=0.002,
+                       boot_seconds=30, status_seconds=60)
+    module = benchLambda.load_module('lambdaCrossAccountAccess')
+    inspectorClients.reset()
+    event = benchLambda.build_event('cross', sim.accounts[0], sim.regions[0], 'start', 'none')
+    with sim.activate(), redirect_stdout(io.StringIO()):
+        module.lambda_handler(event, None)
+
+    # first pending (start call) and running time of every started instance, by group
+    started, running = {}, {}
+    for instance in sim.instances[(sim.accounts[0], sim.regions[0])].values():
+        name = {t['Key']: t['Value'] for t in instance['tags']}.get('InspectorStartGroup')
+        times = dict((state, t) for t, state in reversed(instance['history']))
+        if 'pending' in times:
+            started.setdefault(name, []).append(times['pending'])
+            running.setdefault(name, []).append(times['running'])
+
+    for name, waits_on in expected.items():
+        for prerequisite in waits_on:
+            status_ok = max(running[prerequisite]) + sim.status_seconds
+            assert min(started[name]) >= status_ok, (name, prerequisite, min(started[name]), status_ok)
+    print('simulated start %r: ok' % spec)
+
+
+def main():
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    if benchLambda.LAMBDA_DIR not in sys.path:
+        sys.path.insert(0, benchLambda.LAMBDA_DIR)
+    import inspectorEngine
+
+    check_dependencies(inspectorEngine)
+    check_simulated_start('a::b,b::a,c::a', {'c': {'a'}})
+    check_simulated_start('db:1,app:2,web::app', {'app': {'db'}, 'web': {'app'}})
+
+
+if __name__ == '__main__':
+    main()
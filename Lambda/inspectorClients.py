@@ -0,0 +1,88 @@
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED.
+#
+# boto3 clients, DynamoDB tables and assumed-role credentials, created on first use and kept at
+# module scope so warm invocations reuse them. boto3 itself is only imported when an action
+# first needs a client, so each action only pays for the services it talks to.
+import threading
+from datetime import datetime, timedelta, timezone
+
+from inspectorMetrics import METRICS
+
+# assumed role credentials are refreshed this long before they expire
+CREDENTIALS_MARGIN = timedelta(minutes=5)
+
+_lock = threading.RLock()
+_session = None
+_clients = {}
+_resources = {}
+_tables = {}
+_credentials = {}
+
+
+def _Session():
+    global _session
+    if _session is None:
+        import boto3
+        _session = boto3.session.Session()
+    return _session
+
+# used to get a client, 'credentials' are the Credentials of an assume_role response
+def Client(service_name, region_name_=None, credentials=None):
+    key = (service_name, region_name_, credentials['AccessKeyId'] if credentials else None)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                kwargs = {}
+                if credentials:
+                    kwargs = {'aws_access_key_id': credentials['AccessKeyId'],
+                              'aws_secret_access_key': credentials['SecretAccessKey'],
+                              'aws_session_token': credentials['SessionToken']}
+                client = _clients[key] = METRICS.attach(
+                    _Session().client(service_name, region_name=region_name_, **kwargs))
+    return client
+
+# used to get a DynamoDB table of the given region
+def Table(table_name, region_name_):
+    key = (table_name, region_name_)
+    table = _tables.get(key)
+    if table is None:
+        with _lock:
+            table = _tables.get(key)
+            if table is None:
+                dynamodb_res = _resources.get(region_name_)
+                if dynamodb_res is None:
+                    dynamodb_res = _resources[region_name_] = _Session().resource('dynamodb', region_name=region_name_)
+                    METRICS.attach(dynamodb_res.meta.client)
+                table = _tables[key] = dynamodb_res.Table(table_name)
+    return table
+
+# used to get credentials of a cross-account role, reused until shortly before they expire
+def AssumeRoleCredentials(role_arn):
+    with _lock:
+        credentials = _credentials.get(role_arn)
+        if credentials and credentials['Expiration'] - CREDENTIALS_MARGIN > datetime.now(timezone.utc):
+            return credentials
+
+        assumed_role = Client('sts').assume_role(
+            RoleArn=role_arn,
+            RoleSessionName="testSession",
+            ExternalId="testcrossaccountddb" # <ExternalID that you have defined in Account A>
+        )
+        if credentials:
+            # drop the clients made with the expiring credentials
+            for key in [k for k in _clients if k[2] == credentials['AccessKeyId']]:
+                del _clients[key]
+        credentials = _credentials[role_arn] = assumed_role['Credentials']
+        return credentials
+
+# used to forget every cached client, e.g. between benchmark runs against different backends
+def reset():
+    global _session
+    with _lock:
+        _session = None
+        _clients.clear()
+        _resources.clear()
+        _tables.clear()
+        _credentials.clear()
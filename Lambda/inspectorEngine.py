@@ -0,0 +1,839 @@
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED.
+#
+# Start/verify/stop/inspect/plan workflow shared by every deployment mode. Where the EC2 data
+# comes from and which credentials act on it is up to the provider (see inspectorProviders).
+import logging
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from inspectorClients import Client, Table
+from inspectorLog import EVENTS
+from inspectorMetrics import METRICS
+from inspectorPipeline import Pipeline, Stage
+from inspectorProviders import PROVIDERS, Selected, TagSelection
+from inspectorUptime import ALL_INSTANCES, INSPECT, INSPECT_COMPLETE, READY, START, STOP, UPTIME, ReportTarget, UptimeStore
+
+LOG = logging.getLogger(__name__)
+
+START_TEST_INSTANCES = ['SSM-Test', 'SSMRedhat', 'SSMWin2019']  # test only
+STOP_TEST_INSTANCES = ['SSMRedhat', 'SSMWin2019']  # test only
+# instances start and stop act on, 'select_tags' in the event replaces both
+START_SELECTION = TagSelection({'Name': START_TEST_INSTANCES})  # test only
+STOP_SELECTION = TagSelection({'Name': STOP_TEST_INSTANCES})  # test only
+
+INSTANCES_TABLE_NAME = 'Inspector-Started-Instances'
+EXCEPTIONS_TABLE_NAME = 'Inspector-Exceptions'
+EXCEPTIONS_GSI_NAME = 'AccountId-InstanceRegion-index'
+# every instance the tool starts, until it is stopped again. The reap action stops what is left.
+TRACKED_TABLE_NAME = 'Inspector-Tracked-Instances'
+TRACKED_GSI_NAME = 'AccountId-InstanceRegion-index'
+TRACKED_TTL_DAYS = 7
+REAP_AFTER_HOURS = 12
+REAP_CHUNK_SIZE = 50
+MAX_REAP_WORKERS = 8
+
+# Start ordering tags. Groups with a lower InspectorStartPriority, and the groups listed in
+# InspectorDependsOn (comma separated group names), must pass status checks before a group starts.
+START_GROUP_TAG = 'InspectorStartGroup'
+START_PRIORITY_TAG = 'InspectorStartPriority'
+START_DEPENDS_ON_TAG = 'InspectorDependsOn'
+MAX_START_WORKERS = 8
+
+# the sweep action waits for the assessment run before stopping
+ASSESSMENT_POLL_SECONDS = 30
+ASSESSMENT_TIMEOUT_SECONDS = 4200
+ASSESSMENT_FINAL_STATES = ('COMPLETED', 'COMPLETED_WITH_ERRORS', 'FAILED', 'ERROR', 'CANCELED')
+# in Lambda, seconds before the function times out at which the sweep stops waiting for assessment
+# runs, enough for the stop calls, the stop waiters and the final writes
+SWEEP_STOP_RESERVE_SECONDS = 300
+
+# rough figures used to estimate how long a planned run takes
+EST_API_CALL_SECONDS = 0.15
+EST_BOOT_SECONDS = 60
+EST_SHUTDOWN_SECONDS = 60
+WAITER_DELAY_SECONDS = 15
+
+# metrics and log events are both scoped per phase
+@contextmanager
+def phase(name, account_id, region_name_):
+    with METRICS.phase(name, account_id, region_name_), EVENTS.phase(name, account_id, region_name_):
+        yield
+
+# used to clear items in table
+def delete_table_items(table):
+    try:
+        scan = table.scan()
+        with table.batch_writer() as batch:
+            for each in scan['Items']:
+                batch.delete_item(
+                    Key={
+                        'InstanceId': each['InstanceId']
+                    }
+                )
+        EVENTS.info('Table items deleted', table=table.name, items=len(scan['Items']))
+    except Exception as e:
+        EVENTS.error('Table delete exception: %s', e, table=table.name)
+
+# used to read every exception of an account/region in one paginated GSI query, InstanceId -> ExceptionType
+def LoadExceptions(table_excp, account_id, region_name_):
+    from boto3.dynamodb.conditions import Key
+
+    exceptions = {}
+    kwargs = {
+        'IndexName': EXCEPTIONS_GSI_NAME,
+        'KeyConditionExpression': Key('AccountId').eq(account_id) & Key('InstanceRegion').eq(region_name_),
+    }
+    while True:
+        resp = table_excp.query(**kwargs)
+        for item in resp['Items']:
+            exceptions[item['InstanceId']] = item.get('ExceptionType', '')
+        if 'LastEvaluatedKey' not in resp:
+            return exceptions
+        kwargs['ExclusiveStartKey'] = resp['LastEvaluatedKey']
+
+# used to read the tracked instances of an account/region started before 'started_before' (epoch
+# seconds) in one paginated GSI query
+def LoadTrackedInstances(table_trk, account_id, region_name_, started_before):
+    from boto3.dynamodb.conditions import Attr, Key
+
+    tracked = []
+    kwargs = {
+        'IndexName': TRACKED_GSI_NAME,
+        'KeyConditionExpression': Key('AccountId').eq(account_id) & Key('InstanceRegion').eq(region_name_),
+        'FilterExpression': Attr('StartedAt').lt(int(started_before)),
+    }
+    while True:
+        resp = table_trk.query(**kwargs)
+        tracked.extend(item['InstanceId'] for item in resp['Items'])
+        if 'LastEvaluatedKey' not in resp:
+            return tracked
+        kwargs['ExclusiveStartKey'] = resp['LastEvaluatedKey']
+
+# used to remember instances before they are started, so a run that dies half way can be reaped.
+# A failed write (e.g. a stack without the Tracked table) is logged, the start still goes ahead.
+def TrackInstances(instance_ids, account_id, region_name_):
+    started_at = int(time.time())
+    try:
+        with Table(TRACKED_TABLE_NAME, region_name_).batch_writer() as batch:
+            for instanceId in instance_ids:
+                batch.put_item(Item={
+                    'InstanceId': instanceId,
+                    'AccountId': account_id,
+                    'InstanceRegion': region_name_,
+                    'StartedAt': started_at,
+                    'ExpiresAt': started_at + TRACKED_TTL_DAYS * 86400,
+                })
+    except Exception as e:
+        EVENTS.error('Tracking started instances failed: %s', e, account_id=account_id, region=region_name_)
+
+# used to forget instances that were stopped or deliberately left running, a failed write is logged
+def UntrackInstances(instance_ids, region_name_):
+    if instance_ids:
+        try:
+            with Table(TRACKED_TABLE_NAME, region_name_).batch_writer() as batch:
+                for instanceId in instance_ids:
+                    batch.delete_item(Key={'InstanceId': instanceId})
+        except Exception as e:
+            EVENTS.error('Untracking instances failed: %s', e, region=region_name_)
+
+# used to pick the stopped instances a start acts on, DoNotStart exceptions are left alone
+def SelectStoppedInstances(ec2_instances, exceptions, selection=START_SELECTION):
+    stopped_instances=[]
+
+    METRICS.add_items(len(ec2_instances))
+    for instance in ec2_instances:
+        instanceName = instance['instanceName']
+        instanceId = instance['instanceId']
+        instanceState = instance['instanceState']
+
+        if not Selected(instance, selection):
+            continue
+
+        if (instanceState=='running'):
+            EVENTS.instance('already running', instanceId, instanceName)
+            continue
+        elif (instanceState=='stopped'):
+            if (exceptions.get(instanceId) == 'DoNotStart'):
+                EVENTS.instance('exception, not started', instanceId, instanceName)
+                continue
+            EVENTS.instance('to start', instanceId, instanceName)
+            stopped_instances.append(instanceId)
+
+    return stopped_instances
+
+# used to pick the running instances a stop acts on, any exception keeps an instance running.
+# 'starting' are instances that will be running by then (used when planning).
+def SelectRunningInstances(ec2_instances, exceptions, starting=(), selection=STOP_SELECTION):
+    running_instances=[]
+    starting = set(starting)
+
+    METRICS.add_items(len(ec2_instances))
+    for instance in ec2_instances:
+        instanceName = instance['instanceName']
+        instanceId = instance['instanceId']
+        instanceState = 'running' if instanceId in starting else instance['instanceState']
+
+        # If InstanceId is in Exceptions Table then don't stop intance
+        if (instanceId in exceptions):
+            EVENTS.instance('exception, left running', instanceId, instanceName)
+            continue
+
+        # Skip instances outside the selection
+        if not Selected(instance, selection):
+            continue
+
+        # Skip if instances are in Stopped state else add to List
+        if (instanceState=='stopped'):
+            EVENTS.instance('already stopped', instanceId, instanceName)
+            continue
+        elif (instanceState=='running'):
+            EVENTS.instance('to stop', instanceId, instanceName)
+            running_instances.append(instanceId)
+
+    return running_instances
+
+# used to start all stopped instances. Prerequisite groups wait for 'instance_status_ok' instead.
+def StartStoppedInstances( stopped_instances_now_running, provider, waiter_name='instance_running' ):
+    LaunchStoppedInstances(stopped_instances_now_running, provider)
+    return WaitForStartedInstances(stopped_instances_now_running, provider, waiter_name)
+
+# used to issue the start of all stopped instances without waiting for them
+def LaunchStoppedInstances( stopped_instances_now_running, provider ):
+    # if no entries i.e. all instances running then skip
+    if stopped_instances_now_running:
+        EVENTS.info('Starting %d instances', len(stopped_instances_now_running))
+        EVENTS.debug('Starting instances', instance_ids=stopped_instances_now_running)
+        TrackInstances(stopped_instances_now_running, provider.account_id, provider.region_name_)
+        provider.ec2.start_instances(InstanceIds=stopped_instances_now_running)
+        UPTIME.record(provider.account_id, provider.region_name_, stopped_instances_now_running, START)
+
+    return stopped_instances_now_running
+
+# used to wait till started instances reach the state of the given waiter
+def WaitForStartedInstances( stopped_instances_now_running, provider, waiter_name='instance_running' ):
+    from botocore.exceptions import WaiterError
+
+    if stopped_instances_now_running:
+        # 40 checks every 15s. https://github.com/boto/botocore/blob/master/botocore/data/ec2/2016-11-15/waiters-2.json
+        # wait till all instances in list are in RUNNING state
+        waiter=provider.ec2.get_waiter(waiter_name)
+
+        try:
+            waiter.wait(InstanceIds=stopped_instances_now_running)
+            UPTIME.record(provider.account_id, provider.region_name_, stopped_instances_now_running, READY)
+            EVENTS.info('Instances are up and running', waiter=waiter_name)
+        except WaiterError as e:
+            LOG.debug("Waiter failed: ", exc_info=e)
+            EVENTS.warning('Waiter failed: %s', e)
+
+    return stopped_instances_now_running
+
+# used to split the instances to start into start groups from their ordering tags, in discovery order
+def GroupStoppedInstances(ec2_instances, stopped_instances):
+    wanted = set(stopped_instances)
+    start_groups = {}
+
+    for instance in ec2_instances:
+        instanceId = instance['instanceId']
+        if (instanceId not in wanted):
+            continue
+        tags = instance['instanceTags']
+
+        try:
+            priority = int(tags[START_PRIORITY_TAG]) if tags.get(START_PRIORITY_TAG) else None
+        except ValueError:
+            EVENTS.warning('Ignoring %s=%r', START_PRIORITY_TAG, tags[START_PRIORITY_TAG], instance_id=instanceId)
+            priority = None
+        name = tags.get(START_GROUP_TAG) or ('priority-%d' % priority if priority is not None else '')
+
+        group = start_groups.get(name)
+        if group is None:
+            group = start_groups[name] = {'group': name, 'priority': priority, 'depends_on': [], 'instances': []}
+        elif priority is not None and (group['priority'] is None or priority < group['priority']):
+            group['priority'] = priority
+        for dependency in (tags.get(START_DEPENDS_ON_TAG) or '').split(','):
+            dependency = dependency.strip()
+            if dependency and dependency not in group['depends_on']:
+                group['depends_on'].append(dependency)
+        group['instances'].append(instanceId)
+
+    return list(start_groups.values())
+
+# used to resolve which groups each group waits on. Dependencies on groups that are not being
+# started (already running) are already met. Groups in a cycle lose their dependencies on each other.
+def StartDependencies(start_groups):
+    names = set(g['group'] for g in start_groups)
+    dependencies = {}
+    for group in start_groups:
+        waits_on = set(d for d in group['depends_on'] if d in names)
+        if group['priority'] is not None:
+            waits_on.update(g['group'] for g in start_groups
+                            if g['priority'] is not None and g['priority'] < group['priority'])
+        waits_on.discard(group['group'])
+        dependencies[group['group']] = waits_on
+
+    # topological order. When nothing is ready, the groups of a cycle that waits on nothing outside
+    # itself start together, groups waiting on the cycle keep waiting on it.
+    order = []
+    remaining = dict((name, set(waits_on)) for name, waits_on in dependencies.items())
+    while remaining:
+        ready = sorted(name for name, waits_on in remaining.items() if not waits_on & set(remaining))
+        if not ready:
+            for cycle in BlockingCycles(remaining):
+                EVENTS.warning('Start dependency cycle, starting these groups together', groups=sorted(cycle))
+                for name in cycle:
+                    dependencies[name] -= cycle
+                    remaining[name] -= cycle
+            continue
+        for name in ready:
+            order.append(name)
+            del remaining[name]
+
+    return dependencies, order
+
+# used to find the cycles holding up a topological order: groups that wait on each other, directly
+# or not, and on nothing outside the cycle. 'graph' is group -> groups it waits on.
+def BlockingCycles(graph):
+    reachable = {}
+    for name in graph:
+        seen = set()
+        pending = [name]
+        while pending:
+            for waits_on in graph[pending.pop()]:
+                if waits_on in graph and waits_on not in seen:
+                    seen.add(waits_on)
+                    pending.append(waits_on)
+        reachable[name] = seen
+
+    cycles = []
+    for name in sorted(graph):
+        cycle = set(n for n in reachable[name] if name in reachable[n]) | {name}
+        if len(cycle) > 1 and reachable[name] <= cycle and cycle not in cycles:
+            cycles.append(cycle)
+    return cycles
+
+# used to start the groups in dependency order. A group starts as soon as the groups it waits on
+# pass status checks, independent groups start in parallel.
+def StartInstanceGroups(start_groups, provider, account_id, region_name_):
+    if len(start_groups) <= 1:
+        return StartStoppedInstances([i for g in start_groups for i in g['instances']], provider)
+
+    dependencies, order = StartDependencies(start_groups)
+    prerequisites = set().union(*dependencies.values())
+    by_name = dict((g['group'], g) for g in start_groups)
+    ready = dict((name, threading.Event()) for name in by_name)
+    EVENTS.info('Starting %d groups', len(start_groups),
+                groups=dict((name, sorted(dependencies[name])) for name in order))
+
+    # create the client up front, the workers share it
+    provider.ec2
+
+    def StartGroup(name):
+        try:
+            for dependency in sorted(dependencies[name]):
+                ready[dependency].wait()
+            with phase('start:' + (name or 'ungrouped'), account_id, region_name_):
+                StartStoppedInstances(by_name[name]['instances'], provider,
+                                      'instance_status_ok' if name in prerequisites else 'instance_running')
+        finally:
+            ready[name].set()
+
+    # submitted in topological order, so a worker only ever waits on groups already picked up
+    with ThreadPoolExecutor(max_workers=min(MAX_START_WORKERS, len(order))) as pool:
+        for future in [pool.submit(StartGroup, name) for name in order]:
+            future.result()
+
+    return [i for name in order for i in by_name[name]['instances']]
+
+# used to verify all started instances in list are started not stopped else write to DB
+def VerifyStoppedInstancesAreRunning(ec2_instances, stopped_instances_now_running, table_inst, account_id, region_name_):
+    stopped_instances_now_running = set(stopped_instances_now_running)
+
+    METRICS.add_items(len(ec2_instances))
+    for instance in ec2_instances:
+        instanceName = instance['instanceName']
+        instanceId = instance['instanceId']
+        instanceState = instance['instanceState']
+
+        if(instanceId not in stopped_instances_now_running):
+            continue
+        else:
+            if(instanceState == 'running'):
+                EVENTS.instance('running', instanceId, instanceName)
+                continue
+            else:
+                # Write to DynamoDB if instances in list are in any state other than RUNNING
+                EVENTS.instance('not running, written to DB', instanceId, instanceName)
+                instance_data = {
+                    'InstanceId': instanceId,
+                    'AccountId': account_id,
+                    'InstanceRegion': region_name_
+                }
+                table_inst.put_item(Item=instance_data)
+
+# used to stop all started instances, 'wait' False returns without waiting for them to stop
+def StopRunningInstances(running_instances_now_stopped, provider, wait=True):
+    # Stop all instances in list
+    if running_instances_now_stopped:
+        EVENTS.info('Stopping %d instances', len(running_instances_now_stopped))
+        EVENTS.debug('Stopping instances', instance_ids=running_instances_now_stopped)
+        provider.ec2.stop_instances(InstanceIds=running_instances_now_stopped)
+        # billing ends once an instance is stopping, so the stop call is what counts
+        UPTIME.record(provider.account_id, provider.region_name_, running_instances_now_stopped, STOP)
+        UntrackInstances(running_instances_now_stopped, provider.region_name_)
+        if wait:
+            WaitForStoppedInstances(running_instances_now_stopped, provider)
+
+    return running_instances_now_stopped
+
+# used to wait till stopped instances are in STOPPED state
+def WaitForStoppedInstances(running_instances_now_stopped, provider):
+    from botocore.exceptions import WaiterError
+
+    if running_instances_now_stopped:
+        # 40 checks every 15s. https://github.com/boto/botocore/blob/master/botocore/data/ec2/2016-11-15/waiters-2.json
+        waiter=provider.ec2.get_waiter('instance_stopped')
+
+        try:
+            waiter.wait(InstanceIds=running_instances_now_stopped)
+            EVENTS.info('Running instances have now been Stopped')
+        except WaiterError as e:
+            LOG.debug("Waiter failed: ", exc_info=e)
+            EVENTS.warning('Waiter failed: %s', e)
+
+    return running_instances_now_stopped
+
+# used to inspect all started instances using the pre-configured assessment template in AWS Inspector,
+# returns the assessment run ARN or None if the run could not be started
+def InspectAllInstances(template_arn, inspect_client, account_id=None, region_name_=None):
+    now = datetime.now()
+    try:
+        templates = inspect_client.describe_assessment_templates(
+            assessmentTemplateArns=[
+                template_arn
+            ]
+        )
+        EVENTS.info('Inspector Assessment Template used', template_arn=template_arn,
+                    template_names=[t.get('name') for t in templates['assessmentTemplates']])
+        EVENTS.debug('Inspector Assessment Templates', templates=templates['assessmentTemplates'])
+
+        # run assessment
+        assessment_name = 'assessment_run_'+now.strftime("%m-%d-%Y_%H:%M:%S")
+        EVENTS.info('Assessment (%s) is now being run', assessment_name)
+        response = inspect_client.start_assessment_run(assessmentTemplateArn=template_arn, assessmentRunName=assessment_name )
+        # print(response)
+        UPTIME.record(account_id, region_name_, [ALL_INSTANCES], INSPECT, run_arn=response['assessmentRunArn'])
+        return response['assessmentRunArn']
+    except Exception as e:
+        EVENTS.error('Inspector run failed: %s', e, template_arn=template_arn)
+
+# used to poll an assessment run till it reaches a final state or 'timeout' seconds pass, returns
+# the last state seen
+def WaitForAssessmentRun(run_arn, inspect_client, account_id, region_name_, timeout=ASSESSMENT_TIMEOUT_SECONDS):
+    deadline = time.time() + timeout
+    while True:
+        run = inspect_client.describe_assessment_runs(assessmentRunArns=[run_arn])['assessmentRuns'][0]
+        if run['state'] in ASSESSMENT_FINAL_STATES:
+            completed_at = run.get('completedAt')
+            UPTIME.record(account_id, region_name_, [ALL_INSTANCES], INSPECT_COMPLETE, run_arn=run_arn,
+                          timestamp=completed_at.timestamp() if completed_at else None)
+            EVENTS.info('Assessment run finished', state=run['state'], run_arn=run_arn)
+            return run['state']
+        if time.time() >= deadline:
+            EVENTS.warning('Assessment run still %s after %ds', run['state'], timeout, run_arn=run_arn)
+            return run['state']
+        time.sleep(ASSESSMENT_POLL_SECONDS)
+
+# used to stop one chunk of tracked instances. Exceptions and stop rules are the same as for stop,
+# instances that are not running any more (or no longer exist) are only untracked.
+def ReapInstances(instance_ids, exceptions, provider, selection=STOP_SELECTION):
+    running_instances = SelectRunningInstances(provider.describe(instance_ids), exceptions, selection=selection)
+    StopRunningInstances(running_instances, provider, wait=False)
+    UntrackInstances(sorted(set(instance_ids) - set(running_instances)), provider.region_name_)
+    return running_instances
+
+# used to stop instances left running by runs that timed out or failed. Every account/region takes
+# two GSI queries (tracked instances and exceptions), the stops then run in parallel chunks.
+def ReapStaleInstances(targets, providers, reap_after_hours, selection=STOP_SELECTION):
+    started_before = time.time() - reap_after_hours * 3600.0
+    chunks = []
+    reaped = []
+    for target, provider in zip(targets, providers):
+        account_id, region_name_ = target['account_id'], target['region_name']
+        with phase('reap', account_id, region_name_):
+            tracked = LoadTrackedInstances(Table(TRACKED_TABLE_NAME, region_name_), account_id, region_name_, started_before)
+            exceptions = {}
+            if tracked:
+                exceptions = LoadExceptions(Table(EXCEPTIONS_TABLE_NAME, region_name_), account_id, region_name_)
+                # create the client up front, the workers share it
+                provider.ec2
+        reaped.append({'account_id': account_id, 'region_name': region_name_, 'tracked': len(tracked), 'stopped': 0})
+        for i in range(0, len(tracked), REAP_CHUNK_SIZE):
+            chunks.append((len(reaped) - 1, tracked[i:i + REAP_CHUNK_SIZE], exceptions, provider))
+
+    def ReapChunk(chunk):
+        index, instance_ids, exceptions, provider = chunk
+        with phase('reap', provider.account_id, provider.region_name_):
+            return index, ReapInstances(instance_ids, exceptions, provider, selection)
+
+    if chunks:
+        with ThreadPoolExecutor(max_workers=min(MAX_REAP_WORKERS, len(chunks))) as pool:
+            for index, stopped in pool.map(ReapChunk, chunks):
+                reaped[index]['stopped'] += len(stopped)
+
+    return reaped
+
+# Stages of the sweep action. Each one takes the item of one account/region (the target plus its
+# provider, selections and assessment timeout) and adds its results to it.
+def SweepDiscover(item):
+    item['ec2_instances'] = item['provider'].discover(item['start_selection'])
+
+def SweepSelect(item):
+    account_id, region_name_ = item['account_id'], item['region_name']
+    item['exceptions'] = LoadExceptions(Table(EXCEPTIONS_TABLE_NAME, region_name_), account_id, region_name_)
+    item['to_start'] = SelectStoppedInstances(item['ec2_instances'], item['exceptions'], item['start_selection'])
+    item['start_groups'] = GroupStoppedInstances(item['ec2_instances'], item['to_start'])
+
+def SweepStart(item):
+    # ordered groups have to wait on each other while starting, a single batch is only launched here
+    if len(item['start_groups']) > 1:
+        item['started'] = StartInstanceGroups(item['start_groups'], item['provider'], item['account_id'], item['region_name'])
+    else:
+        item['started'] = LaunchStoppedInstances(item['to_start'], item['provider'])
+
+def SweepWaitReady(item):
+    account_id, region_name_ = item['account_id'], item['region_name']
+    started = item['started']
+    if not started:
+        return
+    if len(item['start_groups']) <= 1:
+        WaitForStartedInstances(started, item['provider'])
+    # read back from EC2 rather than the inventory, so there is no settle time to wait out
+    VerifyStoppedInstancesAreRunning(item['provider'].describe(started), started,
+                                     Table(INSTANCES_TABLE_NAME, region_name_), account_id, region_name_)
+
+def SweepInspect(item):
+    account_id, region_name_ = item['account_id'], item['region_name']
+    inspect_client = Client('inspector', region_name_)
+    item['run_arn'] = InspectAllInstances(item['insp_assmt_template_arn'], inspect_client, account_id, region_name_)
+    if item['run_arn']:
+        timeout = item['assessment_timeout']
+        if item.get('assessment_deadline') is not None:
+            timeout = max(0, min(timeout, item['assessment_deadline'] - time.time()))
+        item['assessment_state'] = WaitForAssessmentRun(item['run_arn'], inspect_client, account_id, region_name_,
+                                                        timeout)
+
+def SweepStop(item):
+    # runs after a failed stage too, unless nothing could have been started
+    if 'exceptions' not in item:
+        return
+    starting = item.get('started')
+    if starting is None:
+        # a start that failed partway may have launched some of to_start while the discovery still
+        # has them stopped, read back which and let them finish booting so they can be stopped
+        starting = []
+        if item['to_start']:
+            starting = [instance['instanceId'] for instance in item['provider'].describe(item['to_start'])
+                        if instance['instanceState'] in ('pending', 'running')]
+            WaitForStartedInstances(starting, item['provider'])
+    running_instances = SelectRunningInstances(item['ec2_instances'], item['exceptions'], starting,
+                                               item['stop_selection'])
+    # not waiting here, a stop worker blocked on a waiter would hold up the stop call of the next
+    # targets. SweepTargets waits once every target has been stopped.
+    item['stopped'] = StopRunningInstances(running_instances, item['provider'], wait=False)
+
+# workers per stage, the stages that wait get the most
+SWEEP_STAGES = [
+    Stage('discover', SweepDiscover, workers=4),
+    Stage('select', SweepSelect, workers=2),
+    Stage('start', SweepStart, workers=4),
+    Stage('wait-ready', SweepWaitReady, workers=8),
+    Stage('inspect', SweepInspect, workers=8),
+    Stage('stop', SweepStop, workers=4, always=True),
+]
+
+# used to run start, inspect and stop for every target as one pipeline. 'workers' caps the workers
+# of every stage, 0 handles one target after the other.
+def SweepTargets(items, workers=None):
+    pipeline = Pipeline(SWEEP_STAGES, lambda name, item: phase(name, item['account_id'], item['region_name']))
+    finished = pipeline.run(items, workers)
+
+    # the instances of all targets are shutting down together by now, so these waits add up to
+    # about the slowest shutdown
+    for item in finished:
+        if not item.get('stopped'):
+            continue
+        started = time.perf_counter()
+        try:
+            with phase('wait-stopped', item['account_id'], item['region_name']):
+                WaitForStoppedInstances(item['stopped'], item['provider'])
+        except Exception as e:
+            EVENTS.error('wait-stopped failed: %s', e, account_id=item['account_id'], region=item['region_name'])
+            item.setdefault('error', 'wait-stopped: %s' % e)
+        item['stage_seconds']['wait-stopped'] = round(time.perf_counter() - started, 3)
+
+    swept = []
+    for item in finished:
+        summary = {
+            'account_id': item['account_id'],
+            'region_name': item['region_name'],
+            'to_start': len(item.get('to_start', ())),
+            'started': len(item.get('started', ())),
+            'run_arn': item.get('run_arn'),
+            'assessment_state': item.get('assessment_state'),
+            'stopped': len(item.get('stopped', ())),
+            'stage_seconds': item.get('stage_seconds', {}),
+        }
+        if 'error' in item:
+            summary['error'] = item['error']
+        swept.append(summary)
+    return swept
+
+# used to estimate API calls and seconds of a start and a stop for one planned target
+def EstimateTarget(provider, discovered, to_start, to_stop):
+    pages = max(1, math.ceil(discovered / float(provider.page_size)))
+    boot_polls = math.ceil(EST_BOOT_SECONDS / float(WAITER_DELAY_SECONDS)) + 1
+    shutdown_polls = math.ceil(EST_SHUTDOWN_SECONDS / float(WAITER_DELAY_SECONDS)) + 1
+
+    # discover + exceptions query, then tracking writes (25 per batch), start + waiter polls,
+    # and discover again to verify
+    start_calls = pages + 1 + ((math.ceil(len(to_start) / 25.0) + 1 + boot_polls) if to_start else 0) + pages
+    start_seconds = start_calls * EST_API_CALL_SECONDS + (EST_BOOT_SECONDS if to_start else 0)
+    # discover + exceptions query, then stop, untracking and waiter polls
+    stop_calls = pages + 1 + ((1 + math.ceil(len(to_stop) / 25.0) + shutdown_polls) if to_stop else 0)
+    stop_seconds = stop_calls * EST_API_CALL_SECONDS + (EST_SHUTDOWN_SECONDS if to_stop else 0)
+
+    return {'start': {'api_calls': start_calls, 'seconds': round(start_seconds, 1)},
+            'stop': {'api_calls': stop_calls, 'seconds': round(stop_seconds, 1)}}
+
+# used to compute what start and stop would do for one target, without changing anything
+def PlanTarget(target, provider, table_excp, start_selection=START_SELECTION, stop_selection=STOP_SELECTION):
+    account_id = target['account_id']
+    region_name_ = target['region_name']
+
+    with phase('discover', account_id, region_name_):
+        ec2_instances = provider.discover(start_selection)
+        exceptions = LoadExceptions(table_excp, account_id, region_name_)
+    with phase('plan', account_id, region_name_):
+        to_start = SelectStoppedInstances(ec2_instances, exceptions, start_selection)
+        to_stop = SelectRunningInstances(ec2_instances, exceptions, to_start, stop_selection)
+
+    excepted = [i['instanceId'] for i in ec2_instances if i['instanceId'] in exceptions]
+    planned = dict(target)
+    planned.update({
+        'counts': {
+            'discovered': len(ec2_instances),
+            'to_start': len(to_start),
+            'already_running': sum(1 for i in ec2_instances if i['instanceState'] == 'running'),
+            'exceptions': len(excepted),
+            'to_stop': len(to_stop),
+            # running after the window: everything running or started, minus what gets stopped
+            'left_running': sum(1 for i in ec2_instances
+                                if i['instanceState'] == 'running' or i['instanceId'] in to_start) - len(to_stop),
+        },
+        'estimate': EstimateTarget(provider, len(ec2_instances), to_start, to_stop),
+        'to_start': to_start,
+        'to_stop': to_stop,
+    })
+    start_groups = GroupStoppedInstances(ec2_instances, to_start)
+    if len(start_groups) > 1:
+        planned['start_groups'] = start_groups
+    return planned
+
+# used to add up the per target counts and estimates. Targets are handled one after the other,
+# but the settle time after starting is only spent once per run.
+def SummarizePlan(planned_targets, settle_seconds):
+    totals = {}
+    for planned in planned_targets:
+        for key, count in planned['counts'].items():
+            totals[key] = totals.get(key, 0) + count
+
+    estimate = {}
+    for action in ('start', 'stop'):
+        estimate[action] = {
+            'api_calls': sum(p['estimate'][action]['api_calls'] for p in planned_targets),
+            'seconds': round(sum(p['estimate'][action]['seconds'] for p in planned_targets), 1),
+        }
+    if planned_targets:
+        estimate['start']['seconds'] = round(estimate['start']['seconds'] + settle_seconds, 1)
+
+    return {'counts': totals, 'estimate': estimate}
+
+# used to get the start and stop selections of a run. 'select_tags' ({'tag': value or [values]})
+# selects instances with all of the given tags for both.
+def GetSelections(event):
+    if event.get('select_tags'):
+        selection = TagSelection(event['select_tags'])
+        return selection, selection
+    return START_SELECTION, STOP_SELECTION
+
+# used to build the list of account/region targets of a run. 'targets' in the event lists them,
+# otherwise the top level account_id/region_name/role_arn is the single target. A plan replays
+# its own targets with the instances it selected.
+def GetTargets(event):
+    if event.get('plan'):
+        return event['plan']['targets']
+
+    defaults = {
+        'account_id': event.get('account_id'),
+        'region_name': event.get('region_name'),
+        'role_arn': event.get('role_arn'),
+        'insp_assmt_template_arn': event.get('insp_assmt_template_arn'),
+    }
+    targets = []
+    for target in event.get('targets') or [{}]:
+        merged = dict(defaults)
+        merged.update(target)
+        targets.append(merged)
+    return targets
+
+# main- called from lambda_handler of each deployment with its default provider and Lambda context.
+# 'provider' in the event or in a target (config, role or hybrid) overrides the default.
+def RunAction(event, default_provider, context=None):
+    # Initialize- get data from event
+    action=event.get('action')
+    targets = GetTargets(event)
+    plan = event.get('plan')
+    start_selection, stop_selection = GetSelections(event)
+
+    METRICS.reset(event.get('account_id'), event.get('region_name'))
+    # log_level: DEBUG also logs every instance, default INFO logs per phase summaries
+    EVENTS.set_level(event.get('log_level'))
+
+    providers = []
+    for target in targets:
+        target.setdefault('provider', event.get('provider', default_provider))
+        providers.append(PROVIDERS[target['provider']](target['account_id'], target['region_name'], target.get('role_arn')))
+
+    try:
+        # Start here
+        if (action=="plan"):
+            planned_targets = [PlanTarget(target, provider, Table(EXCEPTIONS_TABLE_NAME, target['region_name']),
+                                          start_selection, stop_selection)
+                               for target, provider in zip(targets, providers)]
+            result = {
+                'created_at': datetime.now(timezone.utc).isoformat(),
+                'targets': planned_targets,
+            }
+            result.update(SummarizePlan(planned_targets, max(p.settle_seconds for p in providers) if providers else 0))
+            EVENTS.info('Plan', counts=result['counts'], estimate=result['estimate'],
+                        accounts={t['account_id'] + '/' + t['region_name']: t['counts'] for t in planned_targets})
+            return result
+
+        elif (action=="start"):
+            # Clear Instances table
+            for region_name_ in sorted(set(t['region_name'] for t in targets)):
+                with phase('start', None, region_name_):
+                    delete_table_items(Table(INSTANCES_TABLE_NAME, region_name_))
+
+            started = []
+            for target, provider in zip(targets, providers):
+                account_id, region_name_ = target['account_id'], target['region_name']
+                if plan:
+                    start_groups = target.get('start_groups') or [{'group': '', 'priority': None, 'depends_on': [],
+                                                                   'instances': target['to_start']}]
+                else:
+                    # Get EC2 data from the provider and pass to fn to examine if Stopped and if so Start
+                    with phase('discover', account_id, region_name_):
+                        ec2_instances = provider.discover(start_selection)
+                        exceptions = LoadExceptions(Table(EXCEPTIONS_TABLE_NAME, region_name_), account_id, region_name_)
+                    with phase('start', account_id, region_name_):
+                        start_groups = GroupStoppedInstances(ec2_instances, SelectStoppedInstances(ec2_instances, exceptions, start_selection))
+                with phase('start', account_id, region_name_):
+                    started.append(StartInstanceGroups( start_groups, provider, account_id, region_name_ ))
+
+            # Give enough time for EC2's to settle down and for the provider to reflect it, once for all targets
+            with phase('settle', event.get('account_id'), event.get('region_name')):
+                time.sleep(max(p.settle_seconds for p in providers) if providers else 0)
+
+            for target, provider, stopped_instances_now_running in zip(targets, providers, started):
+                account_id, region_name_ = target['account_id'], target['region_name']
+                if not stopped_instances_now_running:
+                    continue
+                with phase('discover', account_id, region_name_):
+                    if plan:
+                        # the plan may have been made with other select_tags, read back the started IDs
+                        ec2_instances = provider.describe(stopped_instances_now_running)
+                    else:
+                        ec2_instances = provider.discover(start_selection)
+                with phase('verify', account_id, region_name_):
+                    VerifyStoppedInstancesAreRunning( ec2_instances, stopped_instances_now_running, Table(INSTANCES_TABLE_NAME, region_name_), account_id, region_name_)
+
+        elif (action=="stop"):
+            for target, provider in zip(targets, providers):
+                account_id, region_name_ = target['account_id'], target['region_name']
+                if plan:
+                    running_instances = target['to_stop']
+                else:
+                    with phase('discover', account_id, region_name_):
+                        ec2_instances = provider.discover(stop_selection)
+                        exceptions = LoadExceptions(Table(EXCEPTIONS_TABLE_NAME, region_name_), account_id, region_name_)
+                    with phase('stop', account_id, region_name_):
+                        running_instances = SelectRunningInstances(ec2_instances, exceptions, selection=stop_selection)
+                with phase('stop', account_id, region_name_):
+                    StopRunningInstances( running_instances, provider )
+
+        elif (action=="inspect"):
+            for target in targets:
+                account_id, region_name_ = target['account_id'], target['region_name']
+                with phase('inspect', account_id, region_name_):
+                    inspect_client = Client('inspector', region_name_)
+                    InspectAllInstances( target['insp_assmt_template_arn'], inspect_client, account_id, region_name_ )
+
+        elif (action=="sweep"):
+            # start, wait, inspect, wait for the assessment and stop each target, as a pipeline
+            for region_name_ in sorted(set(t['region_name'] for t in targets)):
+                with phase('start', None, region_name_):
+                    delete_table_items(Table(INSTANCES_TABLE_NAME, region_name_))
+
+            assessment_timeout = event.get('assessment_timeout', ASSESSMENT_TIMEOUT_SECONDS)
+            # in Lambda, stop waiting for assessment runs in time to stop the instances before the timeout
+            assessment_deadline = None
+            if hasattr(context, 'get_remaining_time_in_millis'):
+                assessment_deadline = time.time() + context.get_remaining_time_in_millis() / 1000.0 - SWEEP_STOP_RESERVE_SECONDS
+            items = []
+            for target, provider in zip(targets, providers):
+                item = dict(target)
+                item.update({'provider': provider, 'start_selection': start_selection,
+                             'stop_selection': stop_selection, 'assessment_timeout': assessment_timeout,
+                             'assessment_deadline': assessment_deadline})
+                items.append(item)
+            swept = SweepTargets(items, event.get('pipeline_workers'))
+            EVENTS.info('Sweep', accounts={t['account_id'] + '/' + t['region_name']: t for t in swept})
+            return {'targets': swept}
+
+        elif (action=="reap"):
+            # Stop instances started more than reap_after_hours ago that no stop has picked up
+            reap_after_hours = event.get('reap_after_hours', REAP_AFTER_HOURS)
+            reaped = ReapStaleInstances(targets, providers, reap_after_hours, stop_selection)
+            EVENTS.info('Reaped stale instances', reap_after_hours=reap_after_hours,
+                        accounts={r['account_id'] + '/' + r['region_name']: {'tracked': r['tracked'], 'stopped': r['stopped']}
+                                  for r in reaped})
+            return {'reap_after_hours': reap_after_hours, 'targets': reaped}
+
+        elif (action=="report"):
+            # Uptime of the instances started by this tool, and how much of it no Inspector run covered
+            since_hours = event.get('since_hours', 168)
+            store = UptimeStore(event.get('uptime_store'))
+            if store is None:
+                raise ValueError('The report action needs uptime_store (or INSPECTOR_UPTIME_STORE) set to dynamodb or sqlite:<path>')
+            reports = []
+            for target in targets:
+                with phase('report', target['account_id'], target['region_name']):
+                    reports.append(ReportTarget(target, store, since_hours))
+            result = {'since_hours': since_hours, 'targets': reports}
+            EVENTS.info('Uptime report', accounts={r['account_id'] + '/' + r['region_name']: r for r in reports})
+            return result
+    finally:
+        # Uptime events are written in batches if a store is set, uptime_store: dynamodb, sqlite:<path> or none (default)
+        try:
+            UPTIME.flush(UptimeStore(event.get('uptime_store')))
+        except Exception as e:
+            EVENTS.error('Uptime write failed: %s', e)
+        EVENTS.flush()
+        # Emit per account/region/phase API metrics, metrics_format: emf (default), json or none
+        METRICS.emit(event.get('metrics_format', 'emf'))
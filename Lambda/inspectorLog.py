@@ -0,0 +1,111 @@
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED.
+#
+# Buffered structured logger for the phase functions. Per-instance events are counted rather
+# than printed, messages are only formatted when their level is enabled, and everything for a
+# phase goes to CloudWatch as JSON lines in a single write when the phase ends.
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40}
+DEFAULT_LEVEL = os.environ.get('INSPECTOR_LOG_LEVEL', 'INFO')
+
+# flush early past this many buffered lines so a huge phase cannot hold the whole log in memory
+MAX_BUFFERED = 1000
+
+
+class PhaseLog:
+    def __init__(self, level=DEFAULT_LEVEL, stream=None):
+        self.stream = stream
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._buffer = []
+        self.set_level(level)
+
+    def set_level(self, level):
+        self.level = LEVELS.get(str(level or DEFAULT_LEVEL).upper(), LEVELS['INFO'])
+
+    def enabled(self, level):
+        return LEVELS[level] >= self.level
+
+    def _scope(self):
+        return getattr(self._local, 'scope', None)
+
+    @contextmanager
+    def phase(self, name, account_id, region):
+        previous = self._scope()
+        scope = self._local.scope = {'phase': name, 'account_id': account_id, 'region': region,
+                                     'counts': OrderedDict(), 'started': time.perf_counter()}
+        try:
+            yield self
+        finally:
+            self._local.scope = previous
+            self._summarize(scope)
+            self.flush()
+
+    # Lazy: msg % args and the JSON record are only built when the level is enabled
+    def log(self, level, msg, *args, **fields):
+        if not self.enabled(level):
+            return
+        record = OrderedDict([('level', level)])
+        scope = self._scope()
+        if scope:
+            record['phase'] = scope['phase']
+            record['account_id'] = scope['account_id']
+            record['region'] = scope['region']
+        record['msg'] = msg % args if args else msg
+        record.update(fields)
+        self._append(record)
+
+    def debug(self, msg, *args, **fields):
+        self.log('DEBUG', msg, *args, **fields)
+
+    def info(self, msg, *args, **fields):
+        self.log('INFO', msg, *args, **fields)
+
+    def warning(self, msg, *args, **fields):
+        self.log('WARNING', msg, *args, **fields)
+
+    def error(self, msg, *args, **fields):
+        self.log('ERROR', msg, *args, **fields)
+
+    # Per-instance event, counted under 'outcome' and summarized when the phase ends
+    def instance(self, outcome, instance_id, name=''):
+        scope = self._scope()
+        if scope is not None:
+            counts = scope['counts']
+            counts[outcome] = counts.get(outcome, 0) + 1
+        if self.level <= LEVELS['DEBUG']:
+            self.debug(outcome, instance_id=instance_id, instance_name=name)
+
+    def _summarize(self, scope):
+        if not self.enabled('INFO'):
+            return
+        self._append(OrderedDict([
+            ('level', 'INFO'), ('phase', scope['phase']), ('account_id', scope['account_id']),
+            ('region', scope['region']), ('msg', 'phase summary'),
+            ('instances', dict(scope['counts'])),
+            ('duration_ms', round((time.perf_counter() - scope['started']) * 1000.0, 3))]))
+
+    def _append(self, record):
+        with self._lock:
+            self._buffer.append(record)
+            full = len(self._buffer) >= MAX_BUFFERED
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            records, self._buffer = self._buffer, []
+        if records:
+            stream = self.stream or sys.stdout
+            stream.write(''.join(json.dumps(r, separators=(',', ':'), default=str) + '\n' for r in records))
+            stream.flush()
+
+
+# shared by the engine and the providers
+EVENTS = PhaseLog()
@@ -0,0 +1,199 @@
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED.
+#
+# Per account/region/phase instrumentation of every boto3 call, collected through botocore
+# event hooks and emitted at the end of lambda_handler as CloudWatch Embedded Metric Format
+# (or plain JSON) on stdout.
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+NAMESPACE = 'InspectorEC2Controls'
+
+# upper bounds in ms, the last bucket catches everything slower
+LATENCY_BUCKETS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float('inf')]
+
+THROTTLE_CODES = {'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottled',
+                  'RequestLimitExceeded', 'TooManyRequestsException', 'SlowDown',
+                  'ProvisionedThroughputExceededException', 'RequestThrottledException'}
+
+
+class OperationStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.throttles = 0
+        self.bytes_received = 0
+        self.latency_sum = 0.0
+        self.latency_min = None
+        self.latency_max = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+    def add_latency(self, ms):
+        self.latency_sum += ms
+        self.latency_min = ms if self.latency_min is None else min(self.latency_min, ms)
+        self.latency_max = max(self.latency_max, ms)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if ms <= bound:
+                self.buckets[i] += 1
+                break
+
+    def histogram(self):
+        # EMF histogram: representative value per non-empty bucket and its count
+        values, counts = [], []
+        lower = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            if count:
+                values.append(self.latency_max if bound == float('inf') else (lower + bound) / 2.0)
+                counts.append(count)
+            lower = bound
+        return {'Values': values, 'Counts': counts, 'Min': self.latency_min or 0.0,
+                'Max': self.latency_max, 'Sum': round(self.latency_sum, 3), 'Count': self.calls}
+
+    def as_dict(self):
+        return {'calls': self.calls, 'errors': self.errors, 'retries': self.retries,
+                'throttles': self.throttles, 'bytes_received': self.bytes_received,
+                'latency_ms': self.histogram()}
+
+
+class PhaseStats:
+    def __init__(self):
+        self.duration = 0.0
+        self.items = 0
+
+
+class Metrics:
+    def __init__(self, namespace=NAMESPACE):
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self, account_id=None, region=None):
+        with self._lock:
+            self.operations = {}
+            self.phases = {}
+        self.default_scope = (account_id or '', region or '', 'init')
+
+    def scope(self):
+        return getattr(self._local, 'scope', None) or self.default_scope
+
+    # Register the hooks on a client (use resource.meta.client for resources)
+    def attach(self, client):
+        events = client.meta.events
+        events.register('provide-client-params', self._before_call, unique_id='inspector-metrics-start')
+        events.register('needs-retry', self._needs_retry, unique_id='inspector-metrics-retry')
+        events.register('after-call', self._after_call, unique_id='inspector-metrics-end')
+        return client
+
+    @contextmanager
+    def phase(self, name, account_id, region):
+        previous = getattr(self._local, 'scope', None)
+        self._local.scope = (account_id or '', region or '', name)
+        started = time.perf_counter()
+        try:
+            yield self
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.phases.setdefault(self._local.scope, PhaseStats()).duration += elapsed
+            self._local.scope = previous
+
+    def add_items(self, count):
+        with self._lock:
+            self.phases.setdefault(self.scope(), PhaseStats()).items += count
+
+    def _stats(self, model):
+        key = self.scope() + ('%s.%s' % (model.service_model.service_name, model.name),)
+        stats = self.operations.get(key)
+        if stats is None:
+            stats = self.operations[key] = OperationStats()
+        return stats
+
+    def _before_call(self, context=None, **kwargs):
+        if context is not None:
+            context['metrics_started'] = time.perf_counter()
+
+    def _needs_retry(self, response=None, operation=None, **kwargs):
+        if response is None or operation is None:
+            return None
+        code = response[1].get('Error', {}).get('Code')
+        if code in THROTTLE_CODES:
+            with self._lock:
+                self._stats(operation).throttles += 1
+        return None
+
+    def _after_call(self, http_response=None, parsed=None, model=None, context=None, **kwargs):
+        started = (context or {}).get('metrics_started')
+        latency = (time.perf_counter() - started) * 1000.0 if started else 0.0
+        parsed = parsed or {}
+        try:
+            received = len(http_response.content or b'')
+        except Exception:
+            received = 0
+        error_code = parsed.get('Error', {}).get('Code')
+
+        with self._lock:
+            stats = self._stats(model)
+            stats.calls += 1
+            stats.add_latency(latency)
+            stats.bytes_received += received
+            stats.retries += parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+            # throttles are counted in _needs_retry, which also sees the final attempt
+            if error_code:
+                stats.errors += 1
+
+    def summary(self):
+        with self._lock:
+            return {
+                'phases': [{'account_id': a, 'region': r, 'phase': p,
+                            'duration_ms': round(s.duration * 1000.0, 3), 'items': s.items}
+                           for (a, r, p), s in self.phases.items()],
+                'operations': [dict({'account_id': a, 'region': r, 'phase': p, 'operation': o}, **s.as_dict())
+                               for (a, r, p, o), s in self.operations.items()],
+            }
+
+    def emf_documents(self):
+        timestamp = int(time.time() * 1000)
+        summary = self.summary()
+        documents = []
+        for phase in summary['phases']:
+            documents.append({
+                '_aws': {'Timestamp': timestamp, 'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [['AccountId', 'Region', 'Phase'], ['Phase']],
+                    'Metrics': [{'Name': 'PhaseDuration', 'Unit': 'Milliseconds'},
+                                {'Name': 'ItemsProcessed', 'Unit': 'Count'}]}]},
+                'AccountId': phase['account_id'], 'Region': phase['region'], 'Phase': phase['phase'],
+                'PhaseDuration': phase['duration_ms'], 'ItemsProcessed': phase['items']})
+        for op in summary['operations']:
+            documents.append({
+                '_aws': {'Timestamp': timestamp, 'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [['AccountId', 'Region', 'Phase', 'Operation'], ['Operation']],
+                    'Metrics': [{'Name': 'Latency', 'Unit': 'Milliseconds'},
+                                {'Name': 'Calls', 'Unit': 'Count'},
+                                {'Name': 'Errors', 'Unit': 'Count'},
+                                {'Name': 'Retries', 'Unit': 'Count'},
+                                {'Name': 'Throttles', 'Unit': 'Count'},
+                                {'Name': 'BytesReceived', 'Unit': 'Bytes'}]}]},
+                'AccountId': op['account_id'], 'Region': op['region'], 'Phase': op['phase'],
+                'Operation': op['operation'], 'Latency': op['latency_ms'], 'Calls': op['calls'],
+                'Errors': op['errors'], 'Retries': op['retries'], 'Throttles': op['throttles'],
+                'BytesReceived': op['bytes_received']})
+        return documents
+
+    # Print collected metrics: 'emf' (one document per line, picked up by CloudWatch), 'json' or 'none'
+    def emit(self, output_format='emf'):
+        if output_format == 'none':
+            return
+        if output_format == 'json':
+            print(json.dumps({'metrics': self.summary()}, separators=(',', ':')))
+            return
+        for document in self.emf_documents():
+            print(json.dumps(document, separators=(',', ':')))
+
+
+# shared by the engine and the providers, reset at the start of every invocation
+METRICS = Metrics()
@@ -0,0 +1,90 @@
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED.
+#
+# Staged executor for the sweep action. Every stage has its own worker threads and hands items
+# (one per account/region) to the next stage through a bounded queue, so while one account waits
+# on a waiter the next one is being discovered and another one stopped. A full queue blocks the
+# stage in front of it, which keeps a slow stage from piling up work.
+import queue
+import threading
+import time
+
+from inspectorLog import EVENTS
+
+PIPELINE_QUEUE_SIZE = 4
+
+_DONE = object()
+
+
+class Stage:
+    # 'always' stages also run for items an earlier stage failed on, e.g. stopping what was started
+    def __init__(self, name, function, workers=1, always=False):
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.always = always
+
+
+class Pipeline:
+    # 'scope' returns the context manager a stage runs an item in, given the stage name and the item
+    def __init__(self, stages, scope, queue_size=PIPELINE_QUEUE_SIZE):
+        self.stages = stages
+        self.scope = scope
+        self.queue_size = queue_size
+
+    # used to run one stage on one item. A failure is kept on the item as 'error' and skips the
+    # remaining stages that are not 'always'.
+    def process(self, stage, item):
+        if 'error' in item and not stage.always:
+            return
+        started = time.perf_counter()
+        try:
+            with self.scope(stage.name, item):
+                stage.function(item)
+        except Exception as e:
+            EVENTS.error('%s failed: %s', stage.name, e, account_id=item.get('account_id'),
+                         region=item.get('region_name'))
+            item.setdefault('error', '%s: %s' % (stage.name, e))
+        item.setdefault('stage_seconds', {})[stage.name] = round(time.perf_counter() - started, 3)
+
+    # used to push every item through all stages and return them in the order they finished.
+    # 'workers' 0 runs each item through every stage before the next item starts, without threads.
+    def run(self, items, workers=None):
+        if workers == 0:
+            for item in items:
+                for stage in self.stages:
+                    self.process(stage, item)
+            return list(items)
+
+        queues = [queue.Queue(self.queue_size) for _ in self.stages] + [queue.Queue()]
+
+        def Work(index):
+            stage = self.stages[index]
+            while True:
+                item = queues[index].get()
+                if item is _DONE:
+                    return
+                self.process(stage, item)
+                queues[index + 1].put(item)
+
+        threads = []
+        for index, stage in enumerate(self.stages):
+            count = stage.workers if workers is None else min(stage.workers, workers)
+            stage_threads = [threading.Thread(target=Work, args=(index,), name='%s-%d' % (stage.name, n), daemon=True)
+                             for n in range(max(1, count))]
+            for thread in stage_threads:
+                thread.start()
+            threads.append(stage_threads)
+
+        for item in items:
+            queues[0].put(item)
+        # a stage is done once its queue is drained, so its workers stop in order behind the items
+        for index, stage_threads in enumerate(threads):
+            for _ in stage_threads:
+                queues[index].put(_DONE)
+            for thread in stage_threads:
+                thread.join()
+
+        finished = []
+        while not queues[-1].empty():
+            finished.append(queues[-1].get())
+        return finished
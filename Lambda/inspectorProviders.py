@@ -0,0 +1,163 @@
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED.
+#
+# Inventory/actuation providers for inspectorEngine. A provider knows how to list the EC2
+# instances of one account/region (discover) and hands out the EC2 client used to start, stop
+# and wait on them. Everything else (exceptions, batching, logging, metrics) lives in the engine.
+import json
+import sys
+
+from inspectorClients import AssumeRoleCredentials, Client
+
+# Ensure the Aggregator is setup in AWS Config and use the name below
+CONFIG_AGGREGATOR_NAME = 'EC2_Instances_within_an_Account'
+
+# used to parse one instance at ingest, the only place tags are read from the API responses.
+# 'tags' is the EC2 (Key/Value) or Config (key/value) tag list and may be missing. Tag keys, names
+# and states repeat across the fleet, so they are interned: records share one copy of each and
+# lookups against the selections below hit the identity fast path.
+def InstanceRecord(instanceId, instanceState, tags, key='Key', value='Value'):
+    instanceTags = {}
+    for tag in tags or ():
+        instanceTags[sys.intern(tag[key])] = sys.intern(tag.get(value) or '')
+    return {'instanceId':instanceId, 'instanceState':sys.intern(instanceState),
+            'instanceName':instanceTags.get('Name', ''), 'instanceTags':instanceTags}
+
+# used to turn {'tag': value or [values]} into a selection, an instance is selected when every
+# listed tag has one of its values. Numbers are compared as the strings tags hold. None or {}
+# selects every instance.
+def TagSelection(select):
+    if not select:
+        return None
+    if not isinstance(select, dict):
+        raise ValueError('select_tags must map tag names to a value or a list of values: %r' % (select,))
+
+    selection = []
+    for key, values in sorted(select.items()):
+        if not isinstance(values, (list, tuple, set, frozenset)):
+            values = [values]
+        for value in values:
+            # bool is an int, but True would never match a 'true' tag
+            if not isinstance(value, (str, int, float)) or isinstance(value, bool):
+                raise ValueError('select_tags value of %r must be a string or number: %r' % (key, value))
+        selection.append((sys.intern(str(key)), frozenset(sys.intern(str(value)) for value in values)))
+    return tuple(selection)
+
+# used in the per instance loops, a dict lookup per selected tag
+def Selected(instance, selection):
+    if selection is None:
+        return True
+    instanceTags = instance['instanceTags']
+    for key, values in selection:
+        if instanceTags.get(key) not in values:
+            return False
+    return True
+
+
+class InventoryProvider:
+    # seconds to wait after starting before verifying, long enough for discover() to see it
+    settle_seconds = 120
+    # results per discover() API call, used to estimate API calls in a plan
+    page_size = 1000
+
+    def __init__(self, account_id, region_name_, role_arn=None):
+        self.account_id = account_id
+        self.region_name_ = region_name_
+        self.role_arn = role_arn
+
+    # List of InstanceRecord() for this account/region, restricted to a TagSelection() if given
+    def discover(self, selection=None):
+        raise NotImplementedError
+
+    # EC2 client used for start/stop/waiters. Not kept on the provider: Client() caches it, and the
+    # assumed role credentials it is made with are renewed shortly before they expire, which a
+    # sweep waiting on a long assessment run outlasts.
+    @property
+    def ec2(self):
+        return self.create_ec2_client()
+
+    def create_ec2_client(self):
+        return Client('ec2', self.region_name_)
+
+    # Same records as discover() for the given instance IDs, read through the EC2 client that acts
+    # on them. Terminated instances that no longer exist are left out instead of failing the call.
+    def describe(self, instance_ids):
+        ec2_instances=[]
+
+        filters = [{"Name" : "instance-id", "Values" : list(instance_ids)}]
+        for page in self.ec2.get_paginator('describe_instances').paginate(Filters=filters):
+            for each_item in page['Reservations']:
+                for instance in each_item['Instances']:
+                    ec2_instances.append(InstanceRecord(instance['InstanceId'], instance['State']['Name'], instance.get('Tags')))
+
+        return ec2_instances
+
+
+# Config aggregator for inventory, EC2 in the Lambda's own account for actuation
+class ConfigProvider(InventoryProvider):
+    # Config takes 3-4m to reflect a state change
+    settle_seconds = 180
+    page_size = 100
+
+    def discover(self, selection=None):
+        ec2_instances=[]
+
+        # Pg. 227 on: https://docs.amazonaws.cn/en_us/config/latest/developerguide/config-dg.pdf
+        # Results come back 100 per page, so page through all of them
+        paginator = Client('config').get_paginator('select_aggregate_resource_config')
+        pages = paginator.paginate(
+            ConfigurationAggregatorName=CONFIG_AGGREGATOR_NAME,
+            Expression='SELECT accountId, awsRegion, resourceId, configuration.state, tags \
+                        WHERE resourceType = \'AWS::EC2::Instance\' and \
+                        accountId = \''+ self.account_id +'\' and \
+                        awsRegion = \''+ self.region_name_ +'\''
+        )
+
+        for config_res in pages:
+            for result in config_res['Results']:
+                val = json.loads(result)
+                instance = InstanceRecord(val['resourceId'], val['configuration']['state']['name'], val.get('tags'), 'key', 'value')
+
+                # Config has no tag filter for the aggregator query, select here
+                if Selected(instance, selection):
+                    ec2_instances.append(instance)
+
+        return ec2_instances
+
+
+# EC2 API through a cross-account role for both inventory and actuation
+class AssumedRoleProvider(InventoryProvider):
+    settle_seconds = 120
+    page_size = 1000
+
+    def create_ec2_client(self):
+        # Get Credentials from Assumed Role, cached across warm invocations
+        return Client('ec2', self.region_name_, AssumeRoleCredentials(self.role_arn))
+
+    def discover(self, selection=None):
+        ec2_instances=[]
+
+        # Define EC2 filters. Pass in AccountID to get EC2 in just this account
+        filters = [{"Name" : "owner-id", "Values" : [self.account_id]},
+                   {"Name" : "instance-state-name", "Values" : ['running','stopped']}]
+        # EC2 applies the tag selection itself, one filter per tag
+        for key, values in selection or ():
+            filters.append({"Name" : "tag:" + key, "Values" : sorted(values)})
+
+        for page in self.ec2.get_paginator('describe_instances').paginate(Filters=filters):
+            for each_item in page['Reservations']:
+                for instance in each_item['Instances']:
+                    ec2_instances.append(InstanceRecord(instance['InstanceId'], instance['State']['Name'], instance.get('Tags')))
+
+        return ec2_instances
+
+
+# Config aggregator for inventory (no EC2 describe throttling), cross-account role for actuation
+class HybridProvider(ConfigProvider):
+    create_ec2_client = AssumedRoleProvider.create_ec2_client
+
+
+PROVIDERS = {
+    'config': ConfigProvider,
+    'role': AssumedRoleProvider,
+    'hybrid': HybridProvider,
+}
@@ -0,0 +1,235 @@
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED.
+#
+# Uptime accounting for the instances the engine starts. The phase functions record start,
+# ready, inspect and stop timestamps, which are buffered and written in batches at the end of
+# an invocation to DynamoDB or a local SQLite file. The 'report' action reads them back and shows
+# how much of the billed uptime was not covered by an Inspector run. Recording is off until a
+# store is configured, the DynamoDB table has to be added to the stack first.
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from inspectorClients import Client, Table
+
+UPTIME_TABLE_NAME = 'Inspector-Instance-Uptime'
+# days before DynamoDB expires an event (TTL attribute ExpiresAt)
+RETENTION_DAYS = 90
+
+START, READY, INSPECT, INSPECT_COMPLETE, STOP = 'start', 'ready', 'inspect', 'inspect_complete', 'stop'
+# inspect events cover a whole account/region rather than one instance
+ALL_INSTANCES = '*'
+
+
+def SeriesId(account_id, region_name_):
+    return '%s#%s' % (account_id, region_name_)
+
+
+def EventKey(timestamp, instance_id, event_name):
+    # zero padded so keys sort by time
+    return '%014.3f#%s#%s' % (timestamp, instance_id, event_name)
+
+
+class UptimeRecorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = []
+
+    # 'timestamp' defaults to now, epoch seconds
+    def record(self, account_id, region_name_, instance_ids, event_name, timestamp=None, **attributes):
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            for instance_id in instance_ids:
+                event = {'account_id': account_id, 'region': region_name_, 'instance_id': instance_id,
+                         'event': event_name, 'timestamp': timestamp}
+                event.update(attributes)
+                self._events.append(event)
+
+    def flush(self, store):
+        with self._lock:
+            events, self._events = self._events, []
+        if events and store is not None:
+            store.write(events)
+        return len(events)
+
+
+class DynamoDbUptimeStore:
+    def __init__(self, table_name=UPTIME_TABLE_NAME):
+        self.table_name = table_name
+
+    def write(self, events):
+        by_region = OrderedDict()
+        for event in events:
+            by_region.setdefault(event['region'], []).append(event)
+
+        # batch_writer sends 25 items per BatchWriteItem and retries unprocessed ones
+        for region_name_, region_events in by_region.items():
+            with Table(self.table_name, region_name_).batch_writer() as batch:
+                for event in region_events:
+                    item = {
+                        'SeriesId': SeriesId(event['account_id'], region_name_),
+                        'EventKey': EventKey(event['timestamp'], event['instance_id'], event['event']),
+                        'AccountId': event['account_id'],
+                        'InstanceRegion': region_name_,
+                        'InstanceId': event['instance_id'],
+                        'Event': event['event'],
+                        'Timestamp': _Decimal(event['timestamp']),
+                        'ExpiresAt': int(event['timestamp'] + RETENTION_DAYS * 86400),
+                    }
+                    if event.get('run_arn'):
+                        item['RunArn'] = event['run_arn']
+                    batch.put_item(Item=item)
+
+    def read(self, account_id, region_name_, since, until):
+        from boto3.dynamodb.conditions import Key
+
+        kwargs = {'KeyConditionExpression': Key('SeriesId').eq(SeriesId(account_id, region_name_)) &
+                  Key('EventKey').between(EventKey(since, '', ''), EventKey(until, '~', '~'))}
+        events = []
+        while True:
+            resp = Table(self.table_name, region_name_).query(**kwargs)
+            for item in resp['Items']:
+                events.append({'account_id': item['AccountId'], 'region': item['InstanceRegion'],
+                               'instance_id': item['InstanceId'], 'event': item['Event'],
+                               'timestamp': float(item['Timestamp']), 'run_arn': item.get('RunArn')})
+            if 'LastEvaluatedKey' not in resp:
+                return events
+            kwargs['ExclusiveStartKey'] = resp['LastEvaluatedKey']
+
+
+class SqliteUptimeStore:
+    def __init__(self, path):
+        import sqlite3
+
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS uptime (series TEXT, event_key TEXT, account_id TEXT, region TEXT, '
+            'instance_id TEXT, event TEXT, timestamp REAL, run_arn TEXT, PRIMARY KEY (series, event_key))')
+
+    def write(self, events):
+        with self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO uptime VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [(SeriesId(e['account_id'], e['region']), EventKey(e['timestamp'], e['instance_id'], e['event']),
+                  e['account_id'], e['region'], e['instance_id'], e['event'], e['timestamp'], e.get('run_arn'))
+                 for e in events])
+
+    def read(self, account_id, region_name_, since, until):
+        rows = self._connection.execute(
+            'SELECT account_id, region, instance_id, event, timestamp, run_arn FROM uptime '
+            'WHERE series = ? AND timestamp BETWEEN ? AND ? ORDER BY event_key',
+            (SeriesId(account_id, region_name_), since, until))
+        return [{'account_id': r[0], 'region': r[1], 'instance_id': r[2], 'event': r[3],
+                 'timestamp': r[4], 'run_arn': r[5]} for r in rows]
+
+
+def _Decimal(value):
+    from decimal import Decimal
+    return Decimal('%.3f' % value)
+
+
+_stores = {}
+
+# used to pick the store from the event's 'uptime_store', or INSPECTOR_UPTIME_STORE if the event has
+# none: 'dynamodb', 'sqlite:<path>' or 'none' (default)
+def UptimeStore(spec):
+    spec = spec or os.environ.get('INSPECTOR_UPTIME_STORE') or 'none'
+    if spec == 'none':
+        return None
+    if spec not in _stores:
+        if spec.startswith('sqlite:'):
+            _stores[spec] = SqliteUptimeStore(spec[len('sqlite:'):])
+        elif spec == 'dynamodb':
+            _stores[spec] = DynamoDbUptimeStore()
+        else:
+            raise ValueError('Unknown uptime_store: %s' % spec)
+    return _stores[spec]
+
+
+def _Overlap(start, end, intervals):
+    covered = 0.0
+    for scan_start, scan_end in intervals:
+        covered += max(0.0, min(end, scan_end) - max(start, scan_start))
+    return covered
+
+# used to backfill when each recorded Inspector run completed, runs still going count up to now
+def ScanIntervals(events, inspect_client, store, now):
+    runs = OrderedDict((e['run_arn'], e['timestamp']) for e in events if e['event'] == INSPECT and e.get('run_arn'))
+    completed = dict((e['run_arn'], e['timestamp']) for e in events
+                     if e['event'] == INSPECT_COMPLETE and e.get('run_arn'))
+
+    pending = [arn for arn in runs if arn not in completed]
+    backfill = []
+    # describe_assessment_runs takes at most 10 ARNs
+    for i in range(0, len(pending), 10):
+        resp = inspect_client.describe_assessment_runs(assessmentRunArns=pending[i:i + 10])
+        for run in resp['assessmentRuns']:
+            if run.get('completedAt'):
+                completed[run['arn']] = run['completedAt'].timestamp()
+                backfill.append((run['arn'], completed[run['arn']]))
+
+    if backfill and store is not None:
+        first = events[0]
+        store.write([{'account_id': first['account_id'], 'region': first['region'], 'instance_id': ALL_INSTANCES,
+                      'event': INSPECT_COMPLETE, 'timestamp': ts, 'run_arn': arn} for arn, ts in backfill])
+
+    # interval merging is not needed, overlapping runs are rare and only overstate coverage
+    return sorted((started, completed.get(arn, now)) for arn, started in runs.items())
+
+# used to turn one account/region's events into uptime windows and totals
+def UptimeReport(events, scan_intervals, now):
+    windows = []
+    open_windows = {}
+    for e in sorted(events, key=lambda e: e['timestamp']):
+        instance_id = e['instance_id']
+        if e['event'] == START:
+            open_windows[instance_id] = {'instance_id': instance_id, 'start': e['timestamp']}
+        elif e['event'] == READY and instance_id in open_windows:
+            open_windows[instance_id].setdefault('ready', e['timestamp'])
+        elif e['event'] == STOP and instance_id in open_windows:
+            window = open_windows.pop(instance_id)
+            window['stop'] = e['timestamp']
+            windows.append(window)
+    # instances we started that have not been stopped yet are still billing
+    for window in open_windows.values():
+        window['stop'] = None
+        windows.append(window)
+
+    totals = {'instances': len(set(w['instance_id'] for w in windows)), 'windows': len(windows),
+              'still_running': sum(1 for w in windows if w['stop'] is None),
+              'uptime_hours': 0.0, 'scanned_hours': 0.0, 'wasted_hours': 0.0, 'boot_seconds_avg': None}
+    boot = []
+    for window in windows:
+        end = window['stop'] if window['stop'] is not None else now
+        uptime = max(0.0, end - window['start'])
+        # a scan only covers an instance once it is up
+        scanned = _Overlap(window.get('ready', window['start']), end, scan_intervals)
+        totals['uptime_hours'] += uptime / 3600.0
+        totals['scanned_hours'] += scanned / 3600.0
+        totals['wasted_hours'] += (uptime - scanned) / 3600.0
+        if 'ready' in window:
+            boot.append(window['ready'] - window['start'])
+
+    for key in ('uptime_hours', 'scanned_hours', 'wasted_hours'):
+        totals[key] = round(totals[key], 3)
+    totals['wasted_pct'] = round(100.0 * totals['wasted_hours'] / totals['uptime_hours'], 1) if totals['uptime_hours'] else 0.0
+    if boot:
+        totals['boot_seconds_avg'] = round(sum(boot) / len(boot), 1)
+    return totals
+
+# used by the 'report' action, 'since_hours' back from now (default a week)
+def ReportTarget(target, store, since_hours=168):
+    now = time.time()
+    events = store.read(target['account_id'], target['region_name'], now - since_hours * 3600.0, now)
+    if not events:
+        return {'account_id': target['account_id'], 'region_name': target['region_name'], 'instances': 0}
+
+    scan_intervals = ScanIntervals(events, Client('inspector', target['region_name']), store, now)
+    report = {'account_id': target['account_id'], 'region_name': target['region_name'],
+              'scans': len(scan_intervals)}
+    report.update(UptimeReport(events, scan_intervals, now))
+    return report
+
+
+# shared by the engine and the phase functions, flushed at the end of every invocation
+UPTIME = UptimeRecorder()